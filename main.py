@@ -7,12 +7,25 @@ import yt_dlp
 import time
 import isodate
 import logging
+import logging.handlers
 import sys
 import os
 from PIL import ImageGrab
 import json
 import hashlib
+import re
+import urllib.parse
+import urllib.error
 import threading
+import shutil
+import sqlite3
+import queue
+import itertools
+import heapq
+import random
+import collections
+import concurrent.futures
+import http.server
 from googleapiclient.discovery import build
 import webbrowser
 import credentials
@@ -22,6 +35,8 @@ sys.path.append("C:\\Users\\eslin\\PycharmProjects\\VideoNavigator_tk")
 from video_navigator import VideoNavigatorApp
 
 class VideoPlayer:
+    LISTBOX_CHUNK_SIZE = 500  # Playlist rows inserted per Tk callback
+
     def __init__(self, root):
         # Initialize the logger
         self.setup_logger()
@@ -29,6 +44,7 @@ class VideoPlayer:
         self.root = root
         self.root.title("Video Player")
         self.root.geometry("800x600")
+        self.screen_height = self.root.winfo_screenheight()  # Caps the video formats we fetch
 
         # set youtube api key
         self.youtube_api_key = credentials.youTubeKey
@@ -48,6 +64,22 @@ class VideoPlayer:
         self.playlist_dir = os.path.join(os.getcwd(), "playlists")  # Default playlist directory
         self.last_opened_dir = os.path.expanduser("~")  # Default to home directory initially
         self.cache_dir = os.path.join(os.getcwd(), "cache")  # Cache directory
+        self.max_cache_size_mb = 500  # Cache size limit enforced by eviction
+        self.progressive_buffer_mb = 2  # Downloaded MB needed before playing a video that is still downloading
+        self.download_rate_limit_kb_per_s = 0  # Aggregate limit for cache downloads, 0 = unlimited
+        self.streaming_download_rate_limit_kb_per_s = 256  # Limit while a network stream is playing, 0 = unlimited
+        self.download_workers = 2  # Number of concurrent background downloads
+        self.slider_refresh_ms = 250  # How often the slider and timestamp are redrawn while playing
+        self.metadata_cache_ttl_s = 600  # How long extracted info without expiring stream URLs is reused
+        # Fragments fetched in parallel, for HLS and other fragmented sources only: the combined YouTube formats
+        # format_policy picks are a single HTTPS file and always use one connection
+        self.concurrent_fragment_downloads = 4
+        self.max_download_connections = 8  # Cap on fragment connections across all download workers
+        self.resume_flush_interval_s = 10  # How often changed resume positions are written to disk
+        self.telemetry_max_file_mb = 5  # Size at which the playback telemetry file is rotated
+        # Format picked for downloads and streams: max video height, preferred codec, max file size (0 = any)
+        self.format_policy = {"max_height": 1080, "preferred_codec": "avc1", "max_filesize_mb": 0}
+        self.cache_eviction_policy = "lru"  # "lru" (least recently played) or "lfu" (least frequently played)
 
         self.screenshot_dir = None  # To store the screenshot path from the config
         # Load configurations from config.json
@@ -67,10 +99,72 @@ class VideoPlayer:
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
 
+        # Downloads in progress live here until they are verified and moved into the cache
+        self.partial_dir = os.path.join(self.cache_dir, "partial")
+        if not os.path.exists(self.partial_dir):
+            os.makedirs(self.partial_dir)
+        self.cleanup_stale_partials()
+
+        # Persistent index of cached videos (URL -> file, size, format, play stats)
+        self.cache_index = CacheIndex(self.cache_dir)
+        self.migrate_cache_keys()
+        self.current_cache_key = None  # Cache key of the video playing now, protected from eviction
+        self.playback_source = None  # "local" (files, cache) or "stream" (network), for the bandwidth budget
+
+        # Calls scheduled by worker threads, run on the Tk main thread by process_ui_calls
+        self.ui_calls = queue.Queue()
+
+        # Slow blocking work (yt-dlp metadata extraction) runs here instead of freezing the Tk thread
+        self.background_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2,
+                                                                         thread_name_prefix="background")
+        self.background_generation = 0  # Bumped when the user starts something else, stale results are dropped
+        self.background_tasks = {}  # Task ID -> generation it belongs to, or None if it can't be superseded
+        self.background_tokens = {}  # Task ID -> cancellation token of a task that is stopped explicitly
+        self.playlist_loads = []  # Cancellation tokens (threading.Event) of the URL loads still adding entries
+        self.background_task_ids = itertools.count()
+        self.listbox_flush_scheduled = False  # Long playlists are inserted into the listbox in chunks
+        # Extracted info dicts, reused until their stream URLs expire
+        self.metadata_cache = MetadataCache(self.metadata_cache_ttl_s)
+
+        # Background cache downloads, run by a bounded pool of workers in priority order
+        self.download_limiter = BandwidthLimiter(self.download_rate_limit_kb_per_s * 1024)
+        # The queue is journaled so downloads interrupted by closing the app resume on the next start
+        self.download_manager = DownloadManager(self.download_video, self.download_workers, self.download_limiter,
+                                                os.path.join(self.partial_dir, DownloadManager.JOURNAL_NAME))
+
+        # Play-while-downloading: VLC reads the growing download through a local HTTP server
+        self.waiting_download_key = None  # Foreground download waiting to start playback
+        self.progressive_jobs = {}  # cache key -> download job served by the stream server, the one playing now
+        self.prepared_next = None  # Next playlist item resolved and pre-parsed for a quick switch
+        self.stream_server = ProgressiveStreamServer(self.get_progressive_source)
+
+        restored = self.download_manager.restore_journal()
+        if restored:
+            logging.info(f"Resuming {restored} download(s) from the previous session")
+
         # VLC player instance
         self.instance = vlc.Instance('--no-video-title-show', '--vout=opengl', '--quiet')
         self.player = self.instance.media_player_new()
 
+        # Playback state, kept up to date by VLC events (see attach_player_events)
+        self.playback_state = "stopped"  # playing, paused, stopped, ended or error
+        self.playback_time_ms = 0
+        self.playback_length_ms = 0
+        self.slider_update_scheduled = False
+
+        # Where each item was left off, so it starts there the next time it is played
+        self.resume_store = ResumeStore(os.path.abspath("resume_positions.json"))
+        self.resume_key = None  # Item key of the media playing now
+        self.resume_key_pending = None  # Item key of the media about to be set, current once VLC switched to it
+
+        # Time to first frame, rebuffers and decoder stats of each playback, for judging caching and prefetching
+        self.telemetry = PlaybackTelemetry(os.path.abspath(PlaybackTelemetry.FILE_NAME),
+                                           self.telemetry_max_file_mb * 1024 * 1024)
+        self.stats_overlay_scheduled = False
+
+        # Keeps playback inside the A-B loop with its own high resolution timer thread
+        self.loop_enforcer = LoopEnforcer(self.player)
+
         # Create a menu bar
         menubar = Menu(self.root)
         self.root.config(menu=menubar)
@@ -183,6 +277,14 @@ class VideoPlayer:
         self.cache_checkbox = tk.Checkbutton(self.url_frame, text="Cache Video", variable=self.cache_var)
         self.cache_checkbox.pack(side=tk.LEFT, padx=10)
 
+        # Audio only checkbox: fetch and play just the audio track (music, talks)
+        self.audio_only_var = tk.IntVar(value=0)
+        self.audio_only_checkbox = tk.Checkbutton(self.url_frame, text="Audio Only", variable=self.audio_only_var)
+        self.audio_only_checkbox.pack(side=tk.LEFT)
+
+        # Busy indicator, shown while a URL is being looked up in the background
+        self.busy_indicator = ttk.Progressbar(self.url_frame, mode="indeterminate", length=80)
+
         # Cache warning and clear button (initially hidden)
         self.cache_warning_frame = None
         self.cache_warning_label = None
@@ -239,6 +341,14 @@ class VideoPlayer:
                                                 command=self.delete_playlist)
         self.delete_playlist_button.grid(row=3, column=1, padx=5, pady=2)
 
+        self.downloads_button = tk.Button(self.playlist_control_frame, text="Downloads",
+                                          command=self.open_downloads_window)
+        self.downloads_button.grid(row=4, column=0, padx=5, pady=2)
+
+        self.upgrade_quality_button = tk.Button(self.playlist_control_frame, text="Upgrade Quality",
+                                                command=self.upgrade_cached_video)
+        self.upgrade_quality_button.grid(row=4, column=1, padx=5, pady=2)
+
         # Checkbox to show/hide playlist
         self.show_playlist_var = tk.IntVar(value=0)
         self.show_playlist_checkbox = tk.Checkbutton(self.control_frame, text="Show Playlist",
@@ -248,8 +358,18 @@ class VideoPlayer:
         # Handling application close
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Update slider and timestamp
-        self.update_slider()
+        # Update slider and timestamp from VLC events; redraw the slider again once it is shown
+        self.attach_player_events()
+        self.root.bind("<Map>", lambda event: self.start_slider_updates(), add="+")
+
+        # Start running calls scheduled by worker threads
+        self.process_ui_calls()
+
+        # Periodically log the aggregate download throughput
+        self.root.after(30000, self.log_download_throughput)
+
+        # Periodically write changed resume positions
+        self.root.after(self.resume_flush_interval_s * 1000, self.flush_resume_positions)
 
         # Mute state
         self.is_muted = False
@@ -296,6 +416,24 @@ class VideoPlayer:
         self.toggle_loop_index = self.options_menu.index("end") + 1  # Track the next index
         self.options_menu.add_command(label="Toggle Loop (off)", command=self.toggle_loop)
 
+        # Playlist play order
+        self.repeat_mode = "off"  # "off", "all" (wrap around) or "one" (repeat the current item)
+        self.shuffle_enabled = False
+        self.shuffle_order = []  # Playlist items in shuffled play order
+        self.repeat_index = self.options_menu.index("end") + 1  # Track the next index
+        self.options_menu.add_command(label="Repeat (off)", command=self.cycle_repeat_mode)
+        self.shuffle_index = self.options_menu.index("end") + 1  # Track the next index
+        self.options_menu.add_command(label="Shuffle (off)", command=self.toggle_shuffle)
+
+        # Live playback stats drawn over the video
+        self.stats_overlay_var = tk.IntVar(value=0)
+        self.options_menu.add_checkbutton(label="Show Playback Stats", variable=self.stats_overlay_var,
+                                          command=self.toggle_stats_overlay)
+
+        # Window listing the cache downloads with their progress
+        self.downloads_window = None
+        self.options_menu.add_command(label="Downloads", command=self.open_downloads_window)
+
         # Create a new Video Navigator menu
         self.video_navigator_menu = Menu(self.root, tearoff=0)
         menubar.add_cascade(label="Video Navigator", menu=self.video_navigator_menu)
@@ -346,11 +484,7 @@ class VideoPlayer:
             return
 
         with open(playlist_path, 'r') as file:
-            self.playlist = json.load(file)
-            self.playlist_listbox.delete(0, tk.END)
-            for item in self.playlist:
-                display_text = item["description"] if item["description"] else item["url"]
-                self.playlist_listbox.insert(tk.END, display_text)
+            self.replace_playlist(json.load(file))
 
             # Automatically play the first video in the playlist if it exists
             if self.playlist:
@@ -365,11 +499,7 @@ class VideoPlayer:
 
             if playlist_path and os.path.exists(playlist_path):
                 with open(playlist_path, 'r') as file:
-                    self.playlist = json.load(file)
-                    self.playlist_listbox.delete(0, tk.END)
-                    for item in self.playlist:
-                        display_text = item["description"] if item["description"] else item["url"]
-                        self.playlist_listbox.insert(tk.END, display_text)
+                    self.replace_playlist(json.load(file))
 
                     # Optionally auto-select the first video
                     if self.playlist:
@@ -390,20 +520,29 @@ class VideoPlayer:
         """Set the start point of the loop."""
         self.loop_start = self.player.get_time() / 1000  # Get current time in seconds
         logging.info(f"Loop start set at {self.loop_start} seconds")
+        self.update_loop_enforcer()
         self.update_menu_labels()
 
     def set_loop_end(self):
         """Set the end point of the loop."""
         self.loop_end = self.player.get_time() / 1000  # Get current time in seconds
         logging.info(f"Loop end set at {self.loop_end} seconds")
+        self.update_loop_enforcer()
         self.update_menu_labels()
 
     def toggle_loop(self):
         """Enable or disable video looping."""
         self.loop_enabled = not self.loop_enabled
         logging.info(f"Looping {'enabled' if self.loop_enabled else 'disabled'}")
+        self.update_loop_enforcer()
         self.update_menu_labels()
 
+    def update_loop_enforcer(self):
+        if self.loop_enabled:
+            self.loop_enforcer.set_loop(self.loop_start, self.loop_end)
+        else:
+            self.loop_enforcer.set_loop(None, None)
+
     def update_menu_labels(self):
         """Update the labels of the loop menu items to show current start, end times and loop status."""
         # Update Loop Start menu item
@@ -503,6 +642,18 @@ class VideoPlayer:
                 self.default_playlist_path = config.get("default_playlist_path", self.playlist_dir)
                 self.screenshot_dir = config.get("default_screenshot_path", "screenshots")
                 self.max_cache_size_mb = config.get("max_cache_size_mb", 500)
+                self.cache_eviction_policy = config.get("cache_eviction_policy", "lru")
+                self.download_workers = config.get("download_workers", 2)
+                self.concurrent_fragment_downloads = config.get("concurrent_fragment_downloads", 4)
+                self.metadata_cache_ttl_s = config.get("metadata_cache_ttl_s", 600)
+                self.slider_refresh_ms = config.get("slider_refresh_ms", 250)
+                self.max_download_connections = config.get("max_download_connections", 8)
+                self.resume_flush_interval_s = config.get("resume_flush_interval_s", 10)
+                self.telemetry_max_file_mb = config.get("telemetry_max_file_mb", 5)
+                self.format_policy.update(config.get("format_policy", {}))
+                self.progressive_buffer_mb = config.get("progressive_buffer_mb", 2)
+                self.download_rate_limit_kb_per_s = config.get("download_rate_limit_kb_per_s", 0)
+                self.streaming_download_rate_limit_kb_per_s = config.get("streaming_download_rate_limit_kb_per_s", 256)
         except FileNotFoundError:
             logging.error("Config file not found, using default values.")
             self.screenshot_dir = "screenshots"
@@ -537,16 +688,66 @@ class VideoPlayer:
             self.remove_cache_warning()
 
     def get_cache_size_mb(self):
-        """Calculate the total cache size in MB."""
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                total_size += os.path.getsize(fp)
-        return total_size / (1024 * 1024)
+        """Return the total cache size in MB from the cache index's running byte counter."""
+        return self.cache_index.total_size() / (1024 * 1024)
+
+    def get_protected_cache_keys(self):
+        """Return the cache keys that must not be evicted: the video playing now and the next queued item."""
+        protected = set()
+        if self.current_cache_key:
+            protected.add(self.current_cache_key)
+
+        selected_index = self.playlist_listbox.curselection()
+        next_index = self.get_next_playlist_index(selected_index[0]) if selected_index else None
+        if next_index is not None:
+            next_item = self.playlist[next_index]
+            if next_item["url"].startswith("http"):
+                protected.add(self.get_cache_key(next_item["url"], audio_only=self.is_audio_only(next_item)))
+        return protected
+
+    def enforce_cache_limit(self):
+        """Evict cached videos according to cache_eviction_policy until the cache fits in max_cache_size_mb."""
+        max_bytes = self.max_cache_size_mb * 1024 * 1024
+        total_bytes = self.cache_index.total_size()
+        if total_bytes <= max_bytes:
+            self.check_cache_size()
+            return
+
+        excluded = self.get_protected_cache_keys()
+        while total_bytes > max_bytes:
+            candidates = self.cache_index.eviction_candidates(self.cache_eviction_policy, exclude=excluded)
+            if not candidates:
+                logging.warning(f"Cache is over its limit ({total_bytes / (1024 * 1024):.2f} MB) "
+                                f"but nothing else can be evicted.")
+                break
+
+            for entry in candidates:
+                file_path = os.path.join(self.cache_dir, entry["path"])
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # The file may be in use, skip it and try the next candidate
+                    logging.error(f"Error evicting cached video {file_path}: {e}")
+                    excluded.add(entry["key"])
+                    continue
+
+                self.cache_index.remove(entry["key"])
+                total_bytes -= entry["size"]
+                logging.info(f"Evicted cached video ({self.cache_eviction_policy}): {file_path} "
+                             f"({entry['size'] / (1024 * 1024):.2f} MB, plays: {entry['play_count']}, "
+                             f"url: {entry['url']})")
+                if total_bytes <= max_bytes:
+                    break
+
+        self.check_cache_size()
 
     def show_cache_warning(self, cache_size_mb):
         """Display a warning about the cache size and add a button to clear the cache."""
+        if self.cache_warning_label:
+            # Banner already shown, just refresh the size
+            self.cache_warning_label.config(text=f"Cache Warning: Current cache size is {cache_size_mb:.2f} MB.")
         if not self.cache_warning_frame:
             self.cache_warning_frame = tk.Frame(self.root)
             self.cache_warning_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -559,15 +760,44 @@ class VideoPlayer:
             self.clear_cache_button.pack(side=tk.LEFT, padx=10)
 
     def clear_cache(self):
-        """Clear the cache directory and remove the warning."""
+        """Clear the cache directory, except the videos playing now or up next, and remove the warning."""
         try:
+            # Drop each entry with its file, so the index never lists a deleted file
+            kept = self.get_protected_cache_keys()
+            while True:
+                entries = self.cache_index.eviction_candidates(exclude=kept, limit=500)
+                if not entries:
+                    break
+                for entry in entries:
+                    file_path = os.path.join(self.cache_dir, entry["path"])
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        # In use (e.g. playing on Windows), keep it and its entry
+                        logging.error(f"Error deleting cached video {file_path}: {e}")
+                        kept.add(entry["key"])
+                        continue
+                    self.cache_index.remove(entry["key"])
+
+            # Then the files the index doesn't know about. The partial directory belongs to the download
+            # workers (.part files being written, the download journal), cleanup_stale_partials handles it
+            kept_paths = {entry["path"] for entry in map(self.cache_index.lookup, kept) if entry}
             for filename in os.listdir(self.cache_dir):
+                # Keep the cache index database
+                if filename.startswith(CacheIndex.DB_NAME) or filename in kept_paths:
+                    continue
                 file_path = os.path.join(self.cache_dir, filename)
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    os.rmdir(file_path)
-            logging.info("Cache cleared.")
+                try:
+                    if os.path.isfile(file_path) or os.path.islink(file_path):
+                        os.unlink(file_path)
+                    elif os.path.isdir(file_path) and os.path.abspath(file_path) != os.path.abspath(self.partial_dir):
+                        shutil.rmtree(file_path)
+                except OSError as e:
+                    logging.error(f"Error deleting {file_path}: {e}")
+            self.cache_index.mark_synced()
+            logging.info(f"Cache cleared, {self.cache_index.count()} video(s) kept.")
             self.remove_cache_warning()
         except Exception as e:
             logging.error(f"Error clearing cache: {e}")
@@ -583,6 +813,219 @@ class VideoPlayer:
             # No need to manually adjust the window size
             # self.root.update_idletasks() # Optional: Force update of the layout to reflect the removed widgets
 
+    def run_on_ui_thread(self, func, *args):
+        """Schedule a call on the Tk main thread. Safe to call from worker threads."""
+        self.ui_calls.put((func, args))
+
+    def run_in_background(self, func, on_result, on_error=None, cancellable=True, on_progress=None, token=None):
+        """Run func on the background pool, then pass its result to on_result (or its exception to on_error)
+        on the Tk thread.
+
+        A cancellable task is superseded by the next cancellable task or by cancel_background_tasks: it still
+        runs to the end, but its result is dropped. Setting token (a threading.Event) drops it the same way.
+
+        With on_progress, func is called with a report function. report(value) passes value to on_progress on
+        the Tk thread and returns False once the task was superseded, so func can stop early. Once a value
+        was used the task is no longer superseded by other tasks, only its token stops it."""
+        if cancellable:
+            self.background_generation += 1
+        task_id = next(self.background_task_ids)
+        self.background_tasks[task_id] = self.background_generation if cancellable else None
+        if token:
+            self.background_tokens[task_id] = token
+        self.update_busy_indicator()
+        superseded = threading.Event()
+
+        def report(value):
+            self.run_on_ui_thread(self.deliver_background_progress, task_id, on_progress, value, superseded)
+            return not superseded.is_set() and not (token and token.is_set())
+
+        def task():
+            try:
+                result = func(report) if on_progress else func()
+            except Exception as e:
+                self.run_on_ui_thread(self.finish_background_task, task_id, on_error, e)
+            else:
+                self.run_on_ui_thread(self.finish_background_task, task_id, on_result, result)
+
+        self.background_executor.submit(task)
+
+    def deliver_background_progress(self, task_id, callback, value, superseded):
+        if task_id not in self.background_tasks or superseded.is_set():
+            return
+        if not self.is_background_task_wanted(task_id):
+            superseded.set()
+            return
+        self.background_tasks[task_id] = None  # Its partial results are in use, only its token stops it now
+        callback(value)
+
+    def finish_background_task(self, task_id, callback, value):
+        wanted = self.is_background_task_wanted(task_id)
+        del self.background_tasks[task_id]
+        token = self.background_tokens.pop(task_id, None)
+        if token in self.playlist_loads:
+            self.playlist_loads.remove(token)
+        self.update_busy_indicator()
+        if not wanted:
+            logging.debug("Dropping the result of a superseded background task")
+            return
+        if callback:
+            callback(value)
+
+    def is_background_task_wanted(self, task_id):
+        token = self.background_tokens.get(task_id)
+        if token and token.is_set():
+            return False
+        generation = self.background_tasks[task_id]
+        return generation is None or generation == self.background_generation
+
+    def cancel_background_tasks(self):
+        """Drop the results of the cancellable background tasks, the user has moved on."""
+        self.background_generation += 1
+        self.update_busy_indicator()
+
+    def new_playlist_load(self, exclusive=True):
+        """Return the cancellation token of a new URL load. An exclusive load stops the ones still running, so
+        two playlists entered one after the other don't get interleaved."""
+        if exclusive:
+            self.cancel_playlist_loads()
+        token = threading.Event()
+        self.playlist_loads.append(token)
+        return token
+
+    def cancel_playlist_loads(self):
+        """Stop adding the entries of the playlists still being loaded and drop their results."""
+        for token in self.playlist_loads:
+            token.set()
+        self.playlist_loads = []
+        self.update_busy_indicator()
+
+    def update_busy_indicator(self):
+        """Show the busy indicator while a background task whose result is still wanted is running."""
+        busy = any(self.is_background_task_wanted(task_id) for task_id in self.background_tasks)
+        if busy and not self.busy_indicator.winfo_ismapped():
+            self.busy_indicator.pack(side=tk.LEFT, padx=5)
+            self.busy_indicator.start(15)
+        elif not busy and self.busy_indicator.winfo_ismapped():
+            self.busy_indicator.stop()
+            self.busy_indicator.pack_forget()
+
+    def extract_info_async(self, url, ydl_opts, on_result, on_error=None, cancellable=True, on_entries=None,
+                           token=None):
+        """Extract a URL's info with yt-dlp on the background pool, see run_in_background.
+
+        With on_entries, a playlist's entries are passed to on_entries in batches while yt-dlp pages through
+        them; the info dict passed to on_result at the end then holds all of them."""
+        if on_entries:
+            self.run_in_background(lambda report: self.extract_info_streamed(url, ydl_opts, report), on_result,
+                                   on_error, cancellable, lambda take_entries: on_entries(take_entries()), token)
+        else:
+            self.run_in_background(lambda: self.extract_info_cached(url, ydl_opts), on_result, on_error, cancellable,
+                                   token=token)
+
+    def extract_info_cached(self, url, ydl_opts):
+        """Extract a URL's info with yt-dlp, or take it from the metadata cache while its stream URLs are valid.
+        Blocks, run it in the background."""
+        flat = bool(ydl_opts.get('extract_flat'))
+        format_selector = ydl_opts.get('format')
+        metadata_key = (self.get_metadata_key(url), flat, format_selector)
+        info_dict = self.metadata_cache.get(metadata_key)
+        if info_dict:
+            logging.debug(f"Using cached metadata for {url}")
+            return info_dict
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info_dict = self.extract_info_with_retry(ydl, url)
+        self.metadata_cache.put(metadata_key, info_dict)
+        if not flat:
+            # A full playlist extraction resolved every video, so playing one of them later needs no extraction
+            for entry in info_dict.get('entries') or []:
+                if entry and entry.get('webpage_url'):
+                    self.metadata_cache.put((self.get_metadata_key(entry['webpage_url']), flat, format_selector), entry)
+        return info_dict
+
+    def extract_info_streamed(self, url, ydl_opts, report):
+        """Flat extraction that hands a playlist's entries to report while they arrive. Blocks, run it in the
+        background with run_in_background. Returns the info dict, with all entries for a playlist."""
+        metadata_key = (self.get_metadata_key(url), True, ydl_opts.get('format'))
+        info_dict = self.metadata_cache.get(metadata_key)
+        if info_dict:
+            logging.debug(f"Using cached metadata for {url}")
+            if 'entries' in info_dict:
+                self.report_playlist_entries(info_dict['entries'], report)
+            return info_dict
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Unprocessed, a playlist's entries are a generator that fetches one page at a time
+            ie_result = self.extract_info_with_retry(ydl, url, process=False)
+            if ie_result.get('_type') not in ('playlist', 'multi_video'):
+                # A single video, or a url/url_transparent redirect (e.g. youtu.be/<id>?list=<id>) that may
+                # resolve to a playlist
+                info_dict = ydl.process_ie_result(ie_result, download=False)
+                if 'entries' in info_dict:
+                    entries = self.report_playlist_entries(info_dict['entries'] or [], report)
+                    if entries is None:
+                        return None  # Superseded, the result is dropped anyway
+                    info_dict = dict(info_dict, entries=entries)
+                self.metadata_cache.put(metadata_key, info_dict)
+                return info_dict
+
+            entries = self.report_playlist_entries(ie_result.get('entries') or [], report)
+        if entries is None:
+            return None  # Superseded, the result is dropped anyway
+
+        info_dict = dict(ie_result, entries=entries)
+        self.metadata_cache.put(metadata_key, info_dict)
+        return info_dict
+
+    def report_playlist_entries(self, entries, report):
+        """Pass entries to report as they arrive, batched by how fast the Tk thread takes them.
+
+        report gets a function that returns (and removes) the entries that arrived so far. Returns all
+        entries, or None if report said the task was superseded."""
+        all_entries = []
+        arrived = []
+        lock = threading.Lock()
+
+        def take_entries():
+            with lock:
+                batch = arrived[:]
+                arrived.clear()
+            return batch
+
+        for entry in entries:
+            if not entry:
+                continue
+            all_entries.append(entry)
+            with lock:
+                arrived.append(entry)
+                first_of_batch = len(arrived) == 1
+            # One call per batch: entries arriving before the Tk thread takes them join it
+            if first_of_batch and not report(take_entries):
+                return None
+        return all_entries
+
+    def get_metadata_key(self, url):
+        """Metadata cache key for a URL: the video's cache key, or the URL itself for playlists."""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url.strip()).query)
+        if "list" in query:
+            return self.normalize_url(url)  # A watch URL with a list is extracted as the playlist
+        return self.get_cache_key(url)
+
+    def process_ui_calls(self):
+        """Run the calls scheduled by worker threads."""
+        while True:
+            try:
+                func, args = self.ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Error running scheduled call {func.__name__}: {e}")
+
+        self.root.after(50, self.process_ui_calls)
+
     def handle_exception(self, exc_type, exc_value, exc_traceback):
         logging.critical("Uncaught exception",
                          exc_info=(exc_type, exc_value, exc_traceback))
@@ -590,19 +1033,44 @@ class VideoPlayer:
     def open_file(self):
         file_path = filedialog.askopenfilename(initialdir=self.last_opened_dir)
         if file_path:
+            self.cancel_background_tasks()
+            self.telemetry.request()
             self.play_local_video(file_path)
             self.add_to_playlist(file_path, "")  # Automatically add to playlist with empty description
             self.last_opened_dir = os.path.dirname(file_path)
 
-    def play_local_video(self, path):
+    def play_local_video(self, path, audio_only=False, resume_key=None, source="local"):
+        self.current_cache_key = None
+        self.waiting_download_key = None
+        # Stop serving downloads played before, keep the one play_progressive registered for this path
+        self.progressive_jobs = {key: job for key, job in self.progressive_jobs.items()
+                                 if self.stream_server.url_for(key) == path}
+        self.playback_source = "local"
         try:
             media = self.instance.media_new(path)
+            self.apply_resume_position(media, resume_key or self.get_resume_key(path))
+            self.start_telemetry(media, source)
             self.player.set_media(media)
             self.player.set_hwnd(self.canvas.winfo_id())  # Embed in canvas
             self.player.play()
+            self.update_audio_placeholder(audio_only)
+            self.prepare_next_item()
         except Exception as e:
             logging.error(f"Error playing local video: {e}")
 
+    def update_audio_placeholder(self, audio_only):
+        """Show a static placeholder on the canvas while an audio-only item plays."""
+        self.canvas.delete("audio_placeholder")
+        if audio_only:
+            self.canvas.update_idletasks()
+            self.canvas.create_text(self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2,
+                                    text="\u266B  Audio only", fill="white", font=("tahoma", 24),
+                                    tags="audio_placeholder")
+
+    def is_audio_only(self, item=None):
+        """Return True if a playlist item (or, without one, the current URL entry) should play audio only."""
+        return bool(item.get("audio_only")) if item is not None else self.audio_only_var.get() == 1
+
     def play_video(self):
         self.player.play()
 
@@ -610,6 +1078,9 @@ class VideoPlayer:
         self.player.pause()
 
     def stop_video(self):
+        self.cancel_background_tasks()
+        self.cancel_playlist_loads()
+        self.telemetry.finish("stopped")  # Before stopping, while the media still has its stats
         self.player.stop()
 
     def seek_video(self, seconds):
@@ -677,193 +1148,688 @@ class VideoPlayer:
         self.control_frame.pack(pady=10, fill=tk.X)
 
     def play_youtube_video(self, event=None):
+        self.telemetry.request()
         if self.cache_var.get() == 1:
             self.play_youtube_video_cached(event)
         else:
             self.play_youtube_video_noncached(event)
 
-    def play_youtube_video_noncached(self, event=None):
+    def play_youtube_video_noncached(self, event=None, cancellable=True):
         url = self.url_entry.get()
         if url:
-            try:
-                ydl_opts = {'extract_flat': False, 'force_generic_extractor': False}
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = ydl.extract_info(url, download=False)
-
-                    if 'entries' in info_dict:
-                        # It's a playlist, add all videos to the existing playlist
-                        initial_playlist_size = self.playlist_listbox.size()
-
-                        for entry in info_dict['entries']:
-                            video_url = None
-                            video_title = entry.get('title', 'Unknown Title')
-
-                            if 'url' in entry:
-                                video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                            elif 'formats' in entry and len(entry['formats']) > 0:
-                                # Find a format with both video and audio
-                                for fmt in entry['formats']:
-                                    if fmt.get('acodec') != 'none' and fmt.get('vcodec') != 'none':
-                                        video_url = fmt['url']
-                                        break
-
-                            if video_url:
-                                video_hash = hashlib.md5(video_url.encode()).hexdigest()
-                                cache_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
-
-                                if os.path.exists(cache_path):
-                                    logging.info(f"Playing cached video: {cache_path}")
-                                    self.add_to_playlist(cache_path, video_title)
-                                else:
-                                    self.add_to_playlist(video_url, video_title)
-                            else:
-                                logging.error(f"No playable video URL found for entry: {video_title}")
-
-                        # Automatically play the first video from the newly added playlist
-                        self.playlist_listbox.selection_clear(0, tk.END)  # Clear any previous selection
-                        self.playlist_listbox.selection_set(initial_playlist_size)  # Select the first newly added item
-                        self.playlist_listbox.activate(initial_playlist_size)
-                        self.play_selected_item_noncached()  # Play the selected item
+            audio_only = self.is_audio_only()
+            # Playlists are only enumerated here, each video is resolved by stream_video when it is played
+            ydl_opts = {'extract_flat': 'in_playlist', 'force_generic_extractor': False,
+                        'format': self.get_format_selector(audio_only)}
+            ingest = {}  # State of a playlist added in batches
+            self.extract_info_async(url, ydl_opts,
+                                    lambda info_dict: self.play_noncached_info(url, info_dict, audio_only, event),
+                                    self.on_noncached_extraction_error, cancellable,
+                                    lambda entries: self.add_noncached_playlist_entries(entries, audio_only, ingest),
+                                    self.new_playlist_load(exclusive=cancellable))
+
+    def on_noncached_extraction_error(self, e):
+        logging.error(f"Error playing YouTube video: {e}")
+        messagebox.showerror("Error", "Failed to play YouTube video. Please check the link and try again.")
+
+    def add_noncached_playlist_entries(self, entries, audio_only, ingest):
+        """Add a batch of playlist entries, streaming the first one added as soon as it arrives."""
+        items = self.playlist_entries_to_items(entries, audio_only)
+        first_index = self.add_playlist_items(items)
+        if first_index is None and items and "first_index" not in ingest:
+            first_index = self.find_playlist_index(items[0]["url"])  # Entered again, play its existing row
+        if first_index is not None and "first_index" not in ingest:
+            ingest["first_index"] = first_index
+            # Automatically play the first video from the newly added playlist
+            self.select_playlist_index(first_index)
+            self.play_selected_item_noncached()  # Play the selected item
+
+    def play_noncached_info(self, url, info_dict, audio_only, event=None):
+        """Stream a single video once the URL's info is extracted. Playlists were already added in batches."""
+        try:
+            if 'entries' in info_dict:
+                logging.info(f"Added playlist with {len(info_dict['entries'])} entries: {url}")
+                return
+
+            # It's a single video, play it from the cache if the index has it
+            if not self.play_from_cache(url, info_dict, audio_only):
+                # Otherwise, stream it directly
+                video_url = None
+                if 'url' in info_dict:
+                    video_url = info_dict['url']  # The format picked by the format selector
+                elif 'formats' in info_dict and len(info_dict['formats']) > 0:
+                    # Find a format with both video and audio
+                    for fmt in info_dict['formats']:
+                        if fmt.get('acodec') != 'none' and fmt.get('vcodec') != 'none':
+                            video_url = fmt['url']
+                            break
+
+                if video_url:
+                    self.current_cache_key = None
+                    self.waiting_download_key = None
+                    self.progressive_jobs = {}  # Stop serving downloads played before
+                    self.playback_source = "stream"
+                    media = self.instance.media_new(video_url)
+                    self.apply_resume_position(media, self.get_resume_key(url))
+                    self.start_telemetry(media, "stream")
+                    self.player.set_media(media)
+                    self.player.set_hwnd(self.canvas.winfo_id())  # Embed in canvas
+                    self.player.play()
+                    self.update_audio_placeholder(audio_only)
+                else:
+                    raise ValueError("No playable video URL with audio found.")
 
-                    else:
-                        # It's a single video, check if it's cached
-                        video_hash = hashlib.md5(url.encode()).hexdigest()
-                        cache_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
-
-                        if os.path.exists(cache_path):
-                            logging.info(f"Playing cached video: {cache_path}")
-                            self.play_local_video(cache_path)
-                        else:
-                            # Otherwise, stream it directly
-                            video_url = None
-                            if 'url' in info_dict:
-                                video_url = info_dict['url']
-                            elif 'formats' in info_dict and len(info_dict['formats']) > 0:
-                                # Find a format with both video and audio
-                                for fmt in info_dict['formats']:
-                                    if fmt.get('acodec') != 'none' and fmt.get('vcodec') != 'none':
-                                        video_url = fmt['url']
-                                        break
-
-                            if video_url:
-                                media = self.instance.media_new(video_url)
-                                self.player.set_media(media)
-                                self.player.set_hwnd(self.canvas.winfo_id())  # Embed in canvas
-                                self.player.play()
-                            else:
-                                raise ValueError("No playable video URL with audio found.")
-
-                        # Add to playlist only if played from URL entry
-                        if event:
-                            self.add_to_playlist(url, info_dict.get('title', ''))
+            # Add to playlist only if played from URL entry
+            if event:
+                self.add_to_playlist(url, info_dict.get('title', ''), audio_only)
 
-            except Exception as e:
-                logging.error(f"Error playing YouTube video: {e}")
-                messagebox.showerror("Error", "Failed to play YouTube video. Please check the link and try again.")
+        except Exception as e:
+            self.on_noncached_extraction_error(e)
 
-    def play_youtube_video_cached(self, event=None):
+    def play_youtube_video_cached(self, event=None, cancellable=True):
         url = self.url_entry.get()
         if url:
-            try:
-                ydl_opts = {
-                    'extract_flat': True,  # Only extract metadata, not actual video
-                    'force_generic_extractor': False
-                }
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info_dict = ydl.extract_info(url, download=False)
-
-                    if 'entries' in info_dict:
-                        # It's a playlist
-                        initial_playlist_size = self.playlist_listbox.size()
-                        first_video_played = False
-
-                        for i, entry in enumerate(info_dict['entries']):
-                            # Ensure only video entries are processed
-                            if entry.get('_type') == 'url':
-                                video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                                video_title = entry['title']
-                                video_hash = hashlib.md5(video_url.encode()).hexdigest()
-                                cache_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
-
-                                # Always add to the application's playlist
-                                self.add_to_playlist(video_url, video_title)
-
-                                if i == 0:
-                                    # Check if the first video is cached and play it immediately
-                                    if os.path.exists(cache_path):
-                                        logging.info(f"Playing cached video: {cache_path}")
-                                        self.play_local_video(cache_path)
-                                        first_video_played = True
-                                    else:
-                                        logging.info(f"Downloading first video: {video_url}")
-                                        self.download_and_play_first_video(video_url, cache_path)
-                                else:
-                                    # For subsequent videos, download if not cached
-                                    if not os.path.exists(cache_path):
-                                        threading.Thread(target=self.download_video,
-                                                         args=(video_url, cache_path)).start()
-
-                        if first_video_played:
-                            return
+            ydl_opts = {
+                'extract_flat': True,  # Only extract metadata, not actual video
+                'force_generic_extractor': False
+            }
+            audio_only = self.is_audio_only()
+            ingest = {}  # State of a playlist added in batches
+            self.extract_info_async(url, ydl_opts, lambda info_dict: self.play_cached_info(url, info_dict, audio_only),
+                                    lambda e: logging.error(f"Error playing YouTube video: {e}"), cancellable,
+                                    lambda entries: self.add_cached_playlist_entries(entries, audio_only, ingest),
+                                    self.new_playlist_load(exclusive=cancellable))
+
+    def add_cached_playlist_entries(self, entries, audio_only, ingest):
+        """Add a batch of playlist entries, playing or downloading the first one added as soon as it arrives."""
+        try:
+            items = self.playlist_entries_to_items(entries, audio_only)
+            first_index = self.add_playlist_items(items)
+            if first_index is None and items and "first_index" not in ingest:
+                first_index = self.find_playlist_index(items[0]["url"])  # Entered again, play its existing row
+            if first_index is None or "first_index" in ingest:
+                return
+            ingest["first_index"] = first_index
+
+            # Select the first new item so the next-up item is known
+            self.select_playlist_index(first_index)
+            video_url = self.playlist[first_index]["url"]
+            # Check if the first video is cached and play it immediately
+            if not self.play_from_cache(video_url, audio_only=audio_only):
+                logging.info(f"Downloading first video: {video_url}")
+                self.download_and_play_first_video(video_url, audio_only)
+
+            # Start on the items after it; the rest is queued when the whole playlist is in
+            self.queue_playlist_downloads()
 
-                    else:
-                        # Single video handling
-                        video_hash = hashlib.md5(url.encode()).hexdigest()
-                        cache_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
+        except Exception as e:
+            logging.error(f"Error playing YouTube video: {e}")
 
-                        if os.path.exists(cache_path):
-                            logging.info(f"Playing cached single video: {cache_path}")
-                            self.play_local_video(cache_path)
-                        else:
-                            self.download_and_play_first_video(url, cache_path)
+    def play_cached_info(self, url, info_dict, audio_only):
+        """Play or download a single video once the URL's info is extracted. Playlists were already added in
+        batches, queue the downloads of all their items."""
+        try:
+            if 'entries' in info_dict:
+                logging.info(f"Added playlist with {len(info_dict['entries'])} entries: {url}")
+                # Queue the remaining uncached videos for the download workers
+                self.queue_playlist_downloads()
 
-                        # Ensure single video is added to playlist
-                        video_title = info_dict.get('title', url)
-                        self.add_to_playlist(url, video_title)
+            else:
+                # Single video handling
+                if not self.play_from_cache(url, info_dict, audio_only):
+                    self.download_and_play_first_video(url, audio_only)
 
-            except Exception as e:
-                logging.error(f"Error playing YouTube video: {e}")
+                # Ensure single video is added to playlist
+                video_title = info_dict.get('title', url)
+                self.add_to_playlist(url, video_title, audio_only)
 
-    def download_and_play_first_video(self, video_url, cache_path):
-        """Download the first video and play it immediately if not cached, otherwise play from cache."""
+        except Exception as e:
+            logging.error(f"Error playing YouTube video: {e}")
+
+    def playlist_entries_to_items(self, entries, audio_only):
+        """Turn flat playlist entries into playlist items."""
+        items = []
+        for entry in entries:
+            video_title = entry.get('title') or 'Unknown Title'
+            if not entry.get('id'):
+                logging.error(f"No playable video URL found for entry: {video_title}")
+                continue
+
+            # Keep the watch URL, even for cached videos: cache lookups use its video ID, and playing the item
+            # tries the cache first, which keeps its play statistics and protection from eviction
+            video_url = f"https://www.youtube.com/watch?v={entry['id']}"
+            item = {"url": video_url, "description": video_title}
+            if audio_only:
+                item["audio_only"] = True  # Saved with the playlist
+            items.append(item)
+        return items
+
+    def download_and_play_first_video(self, video_url, audio_only=False):
+        """Play a video from the cache, or download it and start playing as soon as enough of it is buffered."""
         try:
-            if os.path.exists(cache_path):
-                logging.info(f"Playing cached video: {cache_path}")
-                self.play_local_video(cache_path)
-            else:
+            if not self.play_from_cache(video_url, audio_only=audio_only):
                 logging.info(f"Downloading video: {video_url}")
-                ydl_opts_video = {'format': 'best', 'outtmpl': cache_path}
-
-                with yt_dlp.YoutubeDL(ydl_opts_video) as ydl_video:
-                    ydl_video.download([video_url])
-
-                self.play_local_video(cache_path)
+                # Attaches to the background download of this video if one is already running
+                job = self.download_manager.submit(
+                    video_url, self.get_cache_key(video_url, audio_only=audio_only), DownloadManager.PRIORITY_CURRENT,
+                    on_done=lambda job: self.run_on_ui_thread(self.on_foreground_download_done, job),
+                    options={"audio_only": audio_only})
+                self.waiting_download_key = job.key
+                self.wait_for_progressive_playback(job)
 
         except Exception as e:
             logging.error(f"Error downloading or playing the first video: {e}")
             messagebox.showerror("Error", "Failed to download or play video.")
 
-    def download_video(self, video_url, cache_path):
-        """Download subsequent videos to the cache directory in the background."""
-        try:
-            if not os.path.exists(cache_path):
-                logging.info(f"Downloading video in background: {video_url}")
-                ydl_opts_video = {'format': 'best', 'outtmpl': cache_path}
+    def wait_for_progressive_playback(self, job):
+        """Poll a foreground download until it can be played, from the cache or while still downloading."""
+        if self.waiting_download_key != job.key or job.done.is_set():
+            return  # The user started something else, or on_foreground_download_done took over
 
-                with yt_dlp.YoutubeDL(ydl_opts_video) as ydl_video:
-                    ydl_video.download([video_url])
-                    logging.info(f"Background video download completed: {video_url}")
+        if job.total_bytes and job.tmpfilename and job.downloaded_bytes >= self.progressive_buffer_mb * 1024 * 1024:
+            self.play_progressive(job)
+        else:
+            self.root.after(250, self.wait_for_progressive_playback, job)
+
+    def on_foreground_download_done(self, job):
+        """Completion callback of the download the user is waiting for, run on the Tk thread."""
+        if self.waiting_download_key != job.key:
+            return  # Already playing it progressively, or the user moved on
+
+        if job.state == "finished":
+            self.play_from_cache(job.url, audio_only=job.options.get("audio_only", False))
+        elif job.state == "failed":
+            # Only reached once the retries ran out
+            messagebox.showerror("Error", f"Failed to download video after {job.attempts} attempt(s): {job.error}\n\n"
+                                          "It is listed under failed downloads in the Downloads window.")
+        else:
+            logging.info(f"Download cancelled before playback started: {job.url}")
+
+    def play_progressive(self, job):
+        """Play a download that is still in progress through the local progressive stream server."""
+        logging.info(f"Playing video while downloading ({job.downloaded_bytes} of {job.total_bytes} bytes): "
+                     f"{job.url}")
+        self.progressive_jobs[job.key] = job
+        self.play_local_video(self.stream_server.url_for(job.key), job.options.get("audio_only", False),
+                              self.get_resume_key(job.url), "progressive")
+        self.current_cache_key = job.key
+
+    def get_progressive_source(self, cache_key):
+        """Return (job, candidate file paths) for a progressive stream, or None. Called from server threads.
+
+        The candidates are the files a download passes through, in order: yt-dlp's .part file, the finished
+        partial file and the final cache file."""
+        job = self.progressive_jobs.get(cache_key)
+        if not job:
+            return None
+        return job, [path for path in (job.tmpfilename, job.filename, job.final_path) if path]
+
+    def download_video(self, job):
+        """Download a queued video to the cache directory (runs on a download worker thread)."""
+        try:
+            cached_video_path = self.get_cached_video_path(job.url, audio_only=job.options.get("audio_only", False))
+            if not cached_video_path or job.options.get("upgrade"):
+                logging.info(f"Downloading video in background: {job.url}")
+                job.state = "downloading"
+                job.started_at = job.started_at or time.time()
+                self.download_to_cache(job.url, job)
+                logging.info(f"Background video download completed: {job.url}")
             else:
-                logging.info(f"Video already in cache: {cache_path}")
+                logging.info(f"Video already in cache: {cached_video_path}")
+            job.state = "finished"
+            self.run_on_ui_thread(self.on_download_finished, job)
 
+        except yt_dlp.utils.DownloadCancelled:
+            job.state = "queued" if job.preempted else "cancelled"
+            logging.info(f"Background video download {'paused' if job.preempted else 'cancelled'}: {job.url}")
         except Exception as e:
-            logging.error(f"Error downloading video in background: {e}")
+            # The download manager retries it with backoff or moves it to the failed list
+            job.state = "failed"
+            job.error = e
+            logging.error(f"Error downloading video in background (attempt {job.attempts + 1}): {e}")
+
+    def on_download_finished(self, job):
+        """Account for a completed download on the Tk thread."""
+        if job.key == self.current_cache_key:
+            # It was played while downloading, count the play now that it is indexed
+            self.cache_index.touch(job.key)
+        elif not self.prepared_next and job.state == "finished":
+            self.prepare_next_item()  # It may be the next item
+        self.enforce_cache_limit()
+
+    def extract_info_with_retry(self, ydl, url, max_delay=2, process=True):
+        """Extract video info without downloading, retrying transient errors with short backoff delays.
+
+        The user is waiting, so this gives up sooner than the download queue does."""
+        attempt = 0
+        while True:
+            try:
+                return ydl.extract_info(url, download=False, process=process)
+            except yt_dlp.utils.DownloadError as e:
+                attempt += 1
+                error_class = self.download_manager.retry_policy.classify(e)
+                if attempt >= min(self.download_manager.retry_policy.max_attempts(error_class), 3):
+                    raise
+                delay = self.download_manager.retry_policy.delay(attempt, max_delay)
+                logging.warning(f"Extraction failed ({error_class}), retrying in {delay:.1f} s: {e}")
+                time.sleep(delay)
+
+    def log_download_throughput(self):
+        """Log the aggregate download rate and queue depth, for capacity planning."""
+        rate = self.download_manager.throughput_sample()
+        jobs = self.download_manager.snapshot()
+        running = sum(1 for job in jobs if job["state"] == "downloading")
+        queued = sum(1 for job in jobs if job["state"] == "queued")
+        if running or rate:
+            logging.info(f"Download throughput: {rate / 1024:.1f} KB/s, {running} running, {queued} queued")
+        self.root.after(30000, self.log_download_throughput)
+
+    def open_downloads_window(self):
+        """Show the cache downloads with their state, size, speed and ETA."""
+        if self.downloads_window and self.downloads_window.winfo_exists():
+            self.downloads_window.lift()
+            return
+
+        self.downloads_window = tk.Toplevel(self.root)
+        self.downloads_window.title("Downloads")
+        self.downloads_window.geometry("750x300")
+
+        columns = ("title", "state", "progress", "speed", "eta")
+        tree = ttk.Treeview(self.downloads_window, columns=columns, show="headings")
+        for column, heading, width in (("title", "Video", 330), ("state", "State", 90),
+                                       ("progress", "Progress", 150), ("speed", "Speed", 80), ("eta", "ETA", 70)):
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, anchor="w")
+
+        # Downloads that ran out of retries
+        failed_frame = tk.Frame(self.downloads_window)
+        failed_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        failed_controls = tk.Frame(failed_frame)
+        failed_controls.pack(fill=tk.X)
+        tk.Label(failed_controls, text="Failed downloads:").pack(side=tk.LEFT, padx=5)
+        tk.Button(failed_controls, text="Clear", command=self.download_manager.clear_dead_letters).pack(side=tk.RIGHT, padx=5)
+        tk.Button(failed_controls, text="Retry All", command=self.download_manager.retry_dead_letters).pack(side=tk.RIGHT)
+
+        failed_columns = ("title", "error_class", "attempts", "error")
+        failed_tree = ttk.Treeview(failed_frame, columns=failed_columns, show="headings", height=4)
+        for column, heading, width in (("title", "Video", 250), ("error_class", "Error", 90),
+                                       ("attempts", "Attempts", 70), ("error", "Message", 310)):
+            failed_tree.heading(column, text=heading)
+            failed_tree.column(column, width=width, anchor="w")
+        failed_tree.pack(fill=tk.X)
+
+        scrollbar_y = tk.Scrollbar(self.downloads_window, orient=tk.VERTICAL, command=tree.yview)
+        scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.config(yscrollcommand=scrollbar_y.set)
+        tree.pack(fill=tk.BOTH, expand=1)
 
-    def get_cached_video_path(self, url):
-        """Return the path to the cached video if it exists, else None."""
-        video_hash = hashlib.md5(url.encode()).hexdigest()
-        cached_video_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
-        return cached_video_path if os.path.exists(cached_video_path) else None
+        self.refresh_downloads_window(tree, failed_tree)
+
+    def refresh_downloads_window(self, tree, failed_tree, rows=None, failed_rows=None):
+        """Update the downloads list every half second while the window is open.
+
+        rows and failed_rows remember what each tree shows, so only rows that changed are touched: a long queued
+        playlist must not be redrawn from scratch twice a second."""
+        if not self.downloads_window or not self.downloads_window.winfo_exists():
+            return
+        rows = rows if rows is not None else {"values": {}, "order": []}
+        failed_rows = failed_rows if failed_rows is not None else {"values": {}, "order": []}
+        titles = None  # Built from the playlist only when a new row needs a title
+
+        def get_title(iid, shown, url):
+            nonlocal titles
+            if iid in shown["values"]:
+                return shown["values"][iid][0]
+            if titles is None:
+                titles = {item["url"]: item["description"] for item in self.playlist}
+            return titles.get(url) or url
+
+        entries = []
+        occurrences = collections.Counter()
+        for job in self.download_manager.snapshot():
+            # A key can show up again in the history, e.g. downloaded, evicted and downloaded again
+            occurrences[job["key"]] += 1
+            iid = job["key"] if occurrences[job["key"]] == 1 else f"{job['key']}#{occurrences[job['key']]}"
+            if job["total_bytes"]:
+                progress = (f"{job['downloaded_bytes'] / (1024 * 1024):.1f}/"
+                            f"{job['total_bytes'] / (1024 * 1024):.1f} MB "
+                            f"({100 * job['downloaded_bytes'] / job['total_bytes']:.0f}%)")
+            else:
+                progress = f"{job['downloaded_bytes'] / (1024 * 1024):.1f} MB"
+            speed = f"{job['speed'] / 1024:.0f} KB/s" if job["speed"] and job["state"] == "downloading" else ""
+            eta = self.format_time(job["eta"]) if job["eta"] and job["state"] == "downloading" else ""
+            if job["state"] == "retrying":
+                eta = f"retry in {self.format_time(job['retry_in'])}"
+            entries.append((iid, (get_title(iid, rows, job["url"]), job["state"], progress, speed, eta)))
+        self.update_tree_rows(tree, rows, entries)
+
+        failed_entries = [(job["key"], (get_title(job["key"], failed_rows, job["url"]), job["error_class"],
+                                        job["attempts"], job["error"]))
+                          for job in self.download_manager.dead_letter_snapshot()]
+        self.update_tree_rows(failed_tree, failed_rows, failed_entries)
+
+        self.root.after(500, self.refresh_downloads_window, tree, failed_tree, rows, failed_rows)
+
+    def update_tree_rows(self, tree, shown, entries):
+        """Make a Treeview show entries, a list of (iid, values), inserting, updating, moving and deleting only
+        the rows that need it. shown holds the values and order the tree has now."""
+        wanted = dict(entries)
+        for iid in [iid for iid in shown["values"] if iid not in wanted]:
+            tree.delete(iid)
+            del shown["values"][iid]
+        current_order = [iid for iid in shown["order"] if iid in wanted]
+        for iid, values in entries:
+            if iid not in shown["values"]:
+                tree.insert("", tk.END, iid=iid, values=values)
+                current_order.append(iid)
+            elif shown["values"][iid] != values:
+                tree.item(iid, values=values)
+            shown["values"][iid] = values
+
+        order = [iid for iid, values in entries]
+        if order != current_order:
+            # Reprioritized or finished jobs moved: move just the rows that are out of place
+            for position, iid in enumerate(order):
+                if current_order[position] != iid:
+                    current_order.pop(current_order.index(iid, position))
+                    current_order.insert(position, iid)
+                    tree.move(iid, "", position)
+        shown["order"] = order
+
+    def get_download_priority(self, index, current_index, next_index=None):
+        """Priority of playlist item index for the download queue: current item, next-up, then playlist order."""
+        if current_index is None:
+            return DownloadManager.PRIORITY_BACKGROUND + index
+        if index == current_index:
+            return DownloadManager.PRIORITY_CURRENT
+        if index == next_index:
+            return DownloadManager.PRIORITY_NEXT
+        # Items after the current one first, then wrap around to the start of the playlist
+        return DownloadManager.PRIORITY_BACKGROUND + (index - current_index) % len(self.playlist)
+
+    def queue_playlist_downloads(self):
+        """Queue every uncached YouTube item of the playlist, or update its priority if it's already queued."""
+        selected_index = self.playlist_listbox.curselection()
+        current_index = selected_index[0] if selected_index else None
+        next_index = self.get_next_playlist_index(current_index) if current_index is not None else None
+
+        for index, item in enumerate(self.playlist):
+            url = item["url"]
+            if not url.startswith("http"):
+                continue
+            audio_only = self.is_audio_only(item)
+            cache_key = self.get_cache_key(url, audio_only=audio_only)
+            if self.download_manager.is_dead_letter(cache_key):
+                continue  # Gave up on it, retried from the Downloads window or by playing it
+            if self.download_manager.find(cache_key) or not self.get_cached_video_path(url, audio_only=audio_only):
+                self.download_manager.submit(url, cache_key, self.get_download_priority(index, current_index, next_index),
+                                             options={"audio_only": audio_only})
+
+    def download_to_cache(self, video_url, job=None):
+        """Download a video into the cache directory, record it in the cache index and return its path.
+
+        The download goes to the partial directory first (yt-dlp resumes an interrupted .part file there),
+        is checked by verify_download and is then moved into the cache with an atomic rename."""
+        audio_only = bool(job and job.options.get("audio_only"))
+        cache_key = self.get_cache_key(video_url, audio_only=audio_only)
+        # The format is part of the partial file name so a .part file is never resumed with another format
+        outtmpl = os.path.join(self.partial_dir.replace('%', '%%'), f"{cache_key}.%(format_id)s.%(ext)s")
+        ydl_opts_video = {'format': self.get_format_selector(audio_only), 'outtmpl': outtmpl, 'continuedl': True,
+                          'concurrent_fragment_downloads': self.get_fragment_concurrency()}
+        if job:
+            # Tracks progress and lets a queued download be cancelled between chunks (the .part file is kept)
+            ydl_opts_video['progress_hooks'] = [job.progress_hook]
+
+        with yt_dlp.YoutubeDL(ydl_opts_video) as ydl_video:
+            info_dict = ydl_video.extract_info(video_url, download=True)
+            requested = (info_dict.get('requested_downloads') or [{}])[0]
+            partial_path = requested.get('filepath') or ydl_video.prepare_filename(info_dict)
+
+        try:
+            self.verify_download(partial_path, info_dict)
+        except ValueError:
+            # Don't resume from a corrupt file next time
+            os.remove(partial_path)
+            raise
+
+        file_name = f"{cache_key}.{info_dict.get('ext', 'mp4')}"
+        cache_path = os.path.join(self.cache_dir, file_name)
+        old_entry = self.cache_index.lookup(cache_key)
+        os.replace(partial_path, cache_path)
+        if job:
+            job.final_path = cache_path
+        if old_entry and old_entry["path"] != file_name:
+            # Upgraded to a format with another extension, drop the old file
+            try:
+                os.remove(os.path.join(self.cache_dir, old_entry["path"]))
+            except OSError as e:
+                logging.error(f"Error removing replaced cached video {old_entry['path']}: {e}")
+
+        self.cache_index.add(cache_key, file_name, url=self.normalize_url(video_url),
+                             size=os.path.getsize(cache_path), fmt=info_dict.get('format_id'),
+                             height=info_dict.get('height'))
+        logging.info(f"Cached {video_url} as format {info_dict.get('format_id')} "
+                     f"({info_dict.get('height') or '?'}p, {info_dict.get('vcodec')})")
+        return cache_path
+
+    def get_max_video_height(self):
+        """Height cap for downloads and streams: the configured max_height, but no taller than the screen."""
+        max_height = self.format_policy.get("max_height") or 0
+        return min(max_height, self.screen_height) if max_height else self.screen_height
+
+    def get_fragment_concurrency(self):
+        """Parallel fragment downloads per item, shrunk so that all workers together stay within
+        max_download_connections.
+
+        Only fragmented formats (HLS, fragmented DASH from other sites) use more than one. The combined formats
+        get_format_selector picks on YouTube are plain HTTPS files, which this doesn't speed up."""
+        per_worker = max(1, self.max_download_connections // max(1, self.download_workers))
+        return max(1, min(self.concurrent_fragment_downloads, per_worker))
+
+    def get_format_selector(self, audio_only=False):
+        """Build the yt-dlp format selector from format_policy in config.json.
+
+        Only formats with both audio and video are picked ('best'), so no merging with ffmpeg is needed.
+        The preferred codec and max filesize are dropped in turn if no format matches them."""
+        max_filesize_mb = self.format_policy.get("max_filesize_mb")
+        size_filter = f"[filesize<?{max_filesize_mb}M]" if max_filesize_mb else ""
+        if audio_only:
+            # m4a first, it plays everywhere
+            return f"bestaudio[ext=m4a]{size_filter}/bestaudio{size_filter}/bestaudio"
+
+        height_filter = f"[height<=?{self.get_max_video_height()}]"
+        codec = self.format_policy.get("preferred_codec")
+        codec_filter = f"[vcodec^={codec}]" if codec else ""
+
+        selectors = [f"best{height_filter}{size_filter}{codec_filter}", f"best{height_filter}{size_filter}",
+                     f"best{height_filter}", "best"]
+        return "/".join(dict.fromkeys(selectors))  # Drop duplicates, keep order
+
+    def upgrade_cached_video(self):
+        """Re-download the selected playlist item if its cached copy is below the current format policy."""
+        selected_index = self.playlist_listbox.curselection()
+        if not selected_index:
+            return
+        item = self.playlist[selected_index[0]]
+        url = item["url"]
+        if not url.startswith("http") or self.is_audio_only(item):
+            return
+
+        cache_key, _ = self.lookup_cache_entry(url)  # Migrates a legacy entry to the key used below
+        if cache_key == self.current_cache_key:
+            # VLC has the file open, on Windows it can't be replaced
+            messagebox.showinfo("Cache", "The video is playing, upgrade it while another item plays.")
+            return
+        # Ask yt-dlp which format the download would pick now, the policy's max height may not be available
+        ydl_opts = {'extract_flat': False, 'format': self.get_format_selector()}
+        self.run_in_background(lambda: self.extract_info_cached(url, ydl_opts),
+                               lambda info_dict: self.submit_cache_upgrade(url, cache_key, info_dict),
+                               lambda e: logging.error(f"Error checking for a better quality of {url}: {e}"),
+                               cancellable=False)
+
+    def submit_cache_upgrade(self, url, cache_key, info_dict):
+        """Queue the upgrade download unless the cached copy already is the format the policy picks."""
+        if cache_key == self.current_cache_key:
+            messagebox.showinfo("Cache", "The video is playing, upgrade it while another item plays.")
+            return
+        if self.download_manager.find(cache_key):
+            # submit would attach to that job and drop the upgrade option
+            messagebox.showinfo("Cache", "The video is already being downloaded, try again when it is done.")
+            return
+        entry = self.cache_index.lookup(cache_key)
+        picked_height = info_dict.get('height')
+        if entry and (entry["format"] == info_dict.get('format_id') or
+                      (entry["height"] and picked_height and entry["height"] >= picked_height)):
+            messagebox.showinfo("Cache", "The cached copy already has the best quality allowed by the format policy.")
+            return
+
+        logging.info(f"Fetching a better quality copy for the cache ({info_dict.get('format_id')}, "
+                     f"{picked_height or '?'}p): {url}")
+        self.download_manager.submit(url, cache_key, DownloadManager.PRIORITY_NEXT, options={"upgrade": True})
+
+    def verify_download(self, path, info_dict):
+        """Sanity check a finished download against its metadata. Raises ValueError if it looks truncated."""
+        if not os.path.exists(path):
+            raise ValueError(f"Downloaded file is missing: {path}")
+
+        size = os.path.getsize(path)
+        if size == 0:
+            raise ValueError(f"Downloaded file is empty: {path}")
+
+        expected_size = info_dict.get('filesize')
+        if expected_size and size != expected_size:
+            raise ValueError(f"Downloaded file has {size} bytes, expected {expected_size}: {path}")
+
+        expected_size = info_dict.get('filesize_approx')
+        if expected_size and size < expected_size * 0.5:
+            raise ValueError(f"Downloaded file has {size} bytes, expected about {expected_size}: {path}")
+
+        # A video needs at least ~64 kbit/s over its whole duration, audio only (m4a 139, opus 249) ~24 kbit/s
+        duration = info_dict.get('duration')
+        audio_only = info_dict.get('vcodec') == 'none'
+        min_bytes_per_s = 3 * 1024 if audio_only else 8 * 1024
+        if duration and size < duration * min_bytes_per_s:
+            raise ValueError(f"Downloaded file has {size} bytes for {duration} s of {'audio' if audio_only else 'video'}: "
+                             f"{path}")
+
+    def cleanup_stale_partials(self, max_age_days=7):
+        """Delete partial downloads nobody resumed for max_age_days."""
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        for file_name in os.listdir(self.partial_dir):
+            if file_name == DownloadManager.JOURNAL_NAME:
+                continue
+            file_path = os.path.join(self.partial_dir, file_name)
+            try:
+                if os.path.getmtime(file_path) < cutoff:
+                    os.remove(file_path)
+                    logging.info(f"Removed stale partial download: {file_path}")
+            except OSError as e:
+                logging.error(f"Error removing stale partial download {file_path}: {e}")
+
+    def normalize_url(self, url):
+        """Normalize a URL before it is used as a cache key."""
+        return url.strip().split('#', 1)[0]
+
+    def extract_youtube_id(self, url):
+        """Return the YouTube video ID of a watch/short/embed/youtu.be URL, or None."""
+        url = url.strip()
+        if "://" not in url:
+            url = "https://" + url
+        parsed = urllib.parse.urlparse(url)
+        host = parsed.netloc.lower().split(':')[0]
+        if host.startswith("www."):
+            host = host[4:]
+
+        video_id = None
+        if host == "youtu.be":
+            video_id = parsed.path.strip('/').split('/')[0]
+        elif host in ("youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"):
+            if parsed.path == "/watch":
+                video_id = urllib.parse.parse_qs(parsed.query).get('v', [None])[0]
+            else:
+                parts = parsed.path.strip('/').split('/')
+                if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                    video_id = parts[1]
+
+        if video_id and re.fullmatch(r"[A-Za-z0-9_-]{11}", video_id):
+            return video_id
+        return None
+
+    def get_cache_key(self, url, info_dict=None, audio_only=False):
+        """Return the cache index key for a URL: the YouTube video ID when known, else a hash of the URL.
+        Audio-only copies get their own key."""
+        video_id = None
+        if info_dict and info_dict.get('extractor_key') == 'Youtube' and info_dict.get('id'):
+            video_id = info_dict['id']
+        if not video_id:
+            video_id = self.extract_youtube_id(url)
+        cache_key = f"yt_{video_id}" if video_id else self.get_legacy_cache_key(url)
+        return f"{cache_key}.audio" if audio_only else cache_key
+
+    def get_legacy_cache_key(self, url):
+        """Return the md5-of-URL key used by older cache entries."""
+        return hashlib.md5(self.normalize_url(url).encode()).hexdigest()
+
+    def lookup_cache_entry(self, url, info_dict=None, audio_only=False):
+        """Return (cache key, index entry or None) for a URL, migrating a legacy md5-keyed entry on a hit."""
+        cache_key = self.get_cache_key(url, info_dict, audio_only)
+        entry = self.cache_index.lookup(cache_key)
+        if not entry and not audio_only:
+            legacy_key = self.get_legacy_cache_key(url)
+            if legacy_key != cache_key and self.cache_index.lookup(legacy_key):
+                self.migrate_cache_entry(legacy_key, cache_key)
+                entry = self.cache_index.lookup(cache_key)
+        return cache_key, entry
+
+    def migrate_cache_entry(self, old_key, new_key):
+        """Move a cache entry and its file from old_key to new_key."""
+        entry = self.cache_index.lookup(old_key)
+        old_path = os.path.join(self.cache_dir, entry["path"])
+        new_file_name = new_key + os.path.splitext(entry["path"])[1]
+        new_path = os.path.join(self.cache_dir, new_file_name)
+        try:
+            if self.cache_index.lookup(new_key):
+                # Already cached under the canonical key, drop the duplicate
+                os.remove(old_path)
+                self.cache_index.remove(old_key)
+                logging.info(f"Removed duplicate cached video {old_path} (already cached as {new_key})")
+            else:
+                os.replace(old_path, new_path)
+                self.cache_index.rekey(old_key, new_key, new_file_name)
+                logging.info(f"Migrated cached video {old_path} -> {new_path}")
+        except FileNotFoundError:
+            self.cache_index.remove(old_key)
+        except OSError as e:
+            logging.error(f"Error migrating cached video {old_path}: {e}")
+
+    def migrate_cache_keys(self):
+        """One-time migration of md5-keyed cache entries to canonical keys, for entries with a known URL."""
+        if self.cache_index.get_meta("key_scheme") == "canonical":
+            return
+
+        for entry in self.cache_index.entries_with_url():
+            new_key = self.get_cache_key(entry["url"])
+            if new_key != entry["key"]:
+                self.migrate_cache_entry(entry["key"], new_key)
+        self.cache_index.set_meta("key_scheme", "canonical")
+
+    def get_cached_video_path(self, url, info_dict=None, audio_only=False):
+        """Return the path to the cached video if the cache index has it, else None."""
+        cache_key, entry = self.lookup_cache_entry(url, info_dict, audio_only)
+        return os.path.join(self.cache_dir, entry["path"]) if entry else None
+
+    def play_from_cache(self, url, info_dict=None, audio_only=False):
+        """Play the cached copy of a URL if there is one. Returns True if playback started from the cache."""
+        cache_key, entry = self.lookup_cache_entry(url, info_dict, audio_only)
+        if not entry:
+            return False
+
+        cached_video_path = os.path.join(self.cache_dir, entry["path"])
+        logging.info(f"Playing cached video: {cached_video_path}")
+        self.cache_index.touch(cache_key)
+        self.play_local_video(cached_video_path, audio_only, source="cache")
+        self.current_cache_key = cache_key
+        return True
 
     def add_local_to_playlist(self):
         file_path = filedialog.askopenfilename(initialdir=self.last_opened_dir)
@@ -874,14 +1840,56 @@ class VideoPlayer:
     def add_youtube_to_playlist(self):
         url = self.url_entry.get()
         if url:
-            self.add_to_playlist(url, "")
-
-    def add_to_playlist(self, url, description):
-        # Check for duplicates
-        if not any(item["url"] == url for item in self.playlist):
-            self.playlist.append({"url": url, "description": description})
-            display_text = description if description else url
-            self.playlist_listbox.insert(tk.END, display_text)
+            self.add_to_playlist(url, "", self.is_audio_only())
+
+    def add_to_playlist(self, url, description, audio_only=False):
+        item = {"url": url, "description": description}
+        if audio_only:
+            item["audio_only"] = True  # Saved with the playlist
+        self.add_playlist_items([item])
+
+    def add_playlist_items(self, items):
+        """Append items to the playlist, skipping duplicate URLs. Returns the index of the first item added, or
+        None if all were duplicates."""
+        known_urls = {item["url"] for item in self.playlist}
+        first_index = None
+        for item in items:
+            if item["url"] in known_urls:
+                continue
+            known_urls.add(item["url"])
+            if first_index is None:
+                first_index = len(self.playlist)
+            self.playlist.append(item)
+        self.flush_playlist_listbox()
+        return first_index
+
+    def find_playlist_index(self, url):
+        return next((index for index, item in enumerate(self.playlist) if item["url"] == url), None)
+
+    def flush_playlist_listbox(self, min_size=0):
+        """Insert the playlist items the listbox doesn't show yet, one chunk now and the rest in later Tk
+        callbacks so a long playlist doesn't freeze the window. min_size forces that many rows in right away."""
+        start = self.playlist_listbox.size()
+        count = max(self.LISTBOX_CHUNK_SIZE, min_size - start)
+        items = self.playlist[start:start + count]
+        if items:
+            self.playlist_listbox.insert(tk.END, *[item["description"] if item["description"] else item["url"]
+                                                   for item in items])
+        if start + len(items) < len(self.playlist) and not self.listbox_flush_scheduled:
+            self.listbox_flush_scheduled = True
+            self.root.after(10, self.run_scheduled_listbox_flush)
+
+    def run_scheduled_listbox_flush(self):
+        self.listbox_flush_scheduled = False
+        self.flush_playlist_listbox()
+
+    def select_playlist_index(self, index):
+        """Select a playlist item, making sure its listbox row exists."""
+        self.flush_playlist_listbox(min_size=index + 1)
+        self.playlist_listbox.selection_clear(0, tk.END)  # Clear any previous selection
+        self.playlist_listbox.selection_set(index)
+        self.playlist_listbox.activate(index)
+        self.playlist_listbox.see(index)
 
     def load_playlist(self):
         playlist_file = filedialog.askopenfilename(initialdir=self.playlist_dir,
@@ -889,11 +1897,7 @@ class VideoPlayer:
                                                    filetypes=(("JSON Files", "*.json"), ("All Files", "*.*")))
         if playlist_file:
             with open(playlist_file, 'r') as file:
-                self.playlist = json.load(file)
-                self.playlist_listbox.delete(0, tk.END)
-                for item in self.playlist:
-                    display_text = item["description"] if item["description"] else item["url"]
-                    self.playlist_listbox.insert(tk.END, display_text)
+                self.replace_playlist(json.load(file))
 
                 # Automatically play the first video in the playlist if it exists
                 if self.playlist:
@@ -907,11 +1911,7 @@ class VideoPlayer:
                                                    filetypes=(("JSON Files", "*.json"), ("All Files", "*.*")))
         if playlist_file:
             with open(playlist_file, 'r') as file:
-                self.playlist = json.load(file)
-                self.playlist_listbox.delete(0, tk.END)
-                for item in self.playlist:
-                    display_text = item["description"] if item["description"] else item["url"]
-                    self.playlist_listbox.insert(tk.END, display_text)
+                self.replace_playlist(json.load(file))
 
                 # Automatically play the first video in the playlist if it exists
                 if self.playlist:
@@ -929,8 +1929,16 @@ class VideoPlayer:
                 json.dump(self.playlist, file, indent=4)
 
     def clear_playlist(self):
+        self.replace_playlist([])
+
+    def replace_playlist(self, items):
+        """Replace the playlist with items, e.g. a loaded playlist file."""
+        self.cancel_playlist_loads()  # Or they keep adding entries to the new playlist
+        # Nothing left to cache for from the old playlist, except the video playing now
+        self.download_manager.cancel_all(keep={self.current_cache_key, self.waiting_download_key})
         self.playlist_listbox.delete(0, tk.END)  # Clear the listbox
-        self.playlist = []  # Clear the underlying playlist list
+        self.playlist = items
+        self.flush_playlist_listbox()
 
     def delete_playlist(self):
         playlist_file = filedialog.askopenfilename(initialdir=self.playlist_dir,
@@ -946,6 +1954,11 @@ class VideoPlayer:
     def remove_from_playlist(self):
         selected = self.playlist_listbox.curselection()
         if selected:
+            item = self.playlist[selected[0]]
+            if item["url"].startswith("http"):
+                cache_key = self.get_cache_key(item["url"], audio_only=self.is_audio_only(item))
+                if cache_key not in (self.current_cache_key, self.waiting_download_key):
+                    self.download_manager.cancel(cache_key)
             del self.playlist[selected[0]]
             self.playlist_listbox.delete(selected)
 
@@ -954,31 +1967,128 @@ class VideoPlayer:
         if selected_index:
             selected_item = self.playlist[selected_index[0]]
             url = selected_item["url"]
+            audio_only = self.is_audio_only(selected_item)
+            self.cancel_background_tasks()  # Drop a URL lookup started before
 
-            # Check if the video is in the cache
-            video_path = self.get_cached_video_path(url)
-            if video_path:
-                # Play from cache
-                self.play_local_video(video_path)
-            else:
+            # Check if the video is in the cache and play it from there
+            if not self.play_from_cache(url, audio_only=audio_only):
                 # Stream the video if not in the cache
                 if url.startswith("http"):
                     self.url_entry.delete(0, tk.END)
                     self.url_entry.insert(0, url)
-                    self.stream_video(url)  # Stream the video directly
+                    self.stream_video(url, audio_only)  # Stream the video directly
                 else:
-                    self.play_local_video(url)
+                    self.play_local_video(url, audio_only)
+
+    def stream_video(self, url, audio_only=False):
+        self.extract_info_async(url, self.get_stream_ydl_opts(audio_only),
+                                lambda info_dict: self.play_stream(info_dict, audio_only, self.get_resume_key(url)),
+                                lambda e: logging.error(f"Error streaming video: {e}"))
+
+    def get_stream_ydl_opts(self, audio_only=False):
+        return {'extract_flat': False, 'force_generic_extractor': False, 'format': self.get_format_selector(audio_only)}
+
+    def prepare_next_item(self):
+        """Resolve the next playlist item and pre-parse its vlc.Media while the current item plays, so
+        on_video_end can switch to it right away."""
+        self.prepared_next = None
+        selected_index = self.playlist_listbox.curselection()
+        index = self.get_next_playlist_index(selected_index[0]) if selected_index else None
+        if index is None:
+            return
+        item = self.playlist[index]
+        url = item["url"]
+        audio_only = self.is_audio_only(item)
+
+        if not url.startswith("http"):
+            self.set_prepared_next(index, item, url, "local")
+            return
+        cache_key, entry = self.lookup_cache_entry(url, audio_only=audio_only)
+        if entry:
+            self.set_prepared_next(index, item, os.path.join(self.cache_dir, entry["path"]), "local", cache_key)
+        elif not self.cache_var.get():
+            # Not tracked by the busy indicator, nobody is waiting for it
+            self.background_executor.submit(self.resolve_next_stream, index, item, audio_only)
+        # In cached mode it is being downloaded at PRIORITY_NEXT, on_download_finished prepares it when done
+
+    def resolve_next_stream(self, index, item, audio_only):
+        """Resolve the stream URL of the next item on the background pool."""
+        try:
+            info_dict = self.extract_info_cached(item["url"], self.get_stream_ydl_opts(audio_only))
+        except Exception as e:
+            logging.debug(f"Resolving the next item failed for {item['url']}: {e}")
+            return
+        if info_dict.get('url'):
+            expires_at = time.time() + self.metadata_cache.get_ttl(info_dict)
+            self.run_on_ui_thread(self.set_prepared_next, index, item, info_dict['url'], "stream", None, expires_at)
+
+    def set_prepared_next(self, index, item, mrl, source, cache_key=None, expires_at=None):
+        """Create the next item's vlc.Media and start parsing it in the background."""
+        selected_index = self.playlist_listbox.curselection()
+        if (not selected_index or self.get_next_playlist_index(selected_index[0]) != index
+                or self.playlist[index] is not item):
+            return  # The user moved on or the playlist changed meanwhile
+        try:
+            media = self.instance.media_new(mrl)
+            parse_flag = vlc.MediaParseFlag.network if source == "stream" else vlc.MediaParseFlag.local
+            media.parse_with_options(parse_flag, 10000)  # Asynchronous, times out after 10 s
+        except Exception as e:
+            logging.error(f"Error preparing the next item: {e}")
+            return
+        self.prepared_next = {"index": index, "item": item, "media": media, "source": source,
+                              "cache_key": cache_key, "expires_at": expires_at}
+
+    def play_prepared_next(self, index):
+        """Play the prepared next item if it is the item at index and still valid. Returns True if it plays."""
+        prepared, self.prepared_next = self.prepared_next, None
+        if (not prepared or prepared["index"] != index or index >= len(self.playlist)
+                or self.playlist[index] is not prepared["item"]):
+            return False
+        if prepared["expires_at"] and prepared["expires_at"] <= time.time():
+            return False  # The stream URL expired, resolve it again
+
+        logging.info(f"Playing prepared next item: {prepared['item']['url']}")
+        self.cancel_background_tasks()
+        self.current_cache_key = prepared["cache_key"]
+        self.waiting_download_key = None
+        self.progressive_jobs = {}  # Stop serving downloads played before
+        self.playback_source = prepared["source"]
+        try:
+            # Same player and drawable, so VLC keeps its video output for the next input
+            self.apply_resume_position(prepared["media"], self.get_resume_key(prepared["item"]["url"]))
+            self.start_telemetry(prepared["media"], "cache" if prepared["cache_key"] else prepared["source"],
+                                 prepared=True)
+            self.player.set_media(prepared["media"])
+            self.player.play()
+            self.update_audio_placeholder(self.is_audio_only(prepared["item"]))
+        except Exception as e:
+            logging.error(f"Error playing the prepared next item: {e}")
+            return False
 
-    def stream_video(self, url):
+        if prepared["cache_key"]:
+            self.cache_index.touch(prepared["cache_key"])
+        if self.cache_var.get():
+            self.queue_playlist_downloads()
+        self.prepare_next_item()
+        return True
+
+    def play_stream(self, info_dict, audio_only=False, resume_key=None):
+        """Play the stream URL of the format yt-dlp picked."""
+        self.current_cache_key = None
+        self.waiting_download_key = None
+        self.progressive_jobs = {}  # Stop serving downloads played before
+        self.playback_source = "stream"
         try:
-            ydl_opts = {'extract_flat': False, 'force_generic_extractor': False}
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
-                video_url = info_dict['url']
-                media = self.instance.media_new(video_url)
-                self.player.set_media(media)
-                self.player.set_hwnd(self.canvas.winfo_id())  # Embed in canvas
-                self.player.play()
+            video_url = info_dict['url']
+            media = self.instance.media_new(video_url)
+            self.apply_resume_position(media, resume_key or
+                                       self.get_resume_key(info_dict.get('webpage_url', video_url)))
+            self.start_telemetry(media, "stream")
+            self.player.set_media(media)
+            self.player.set_hwnd(self.canvas.winfo_id())  # Embed in canvas
+            self.player.play()
+            self.update_audio_placeholder(audio_only)
+            self.prepare_next_item()
         except Exception as e:
             logging.error(f"Error streaming video: {e}")
 
@@ -987,38 +2097,40 @@ class VideoPlayer:
         if selected_index:
             selected_item = self.playlist[selected_index[0]]
             url = selected_item["url"]
+            audio_only = self.is_audio_only(selected_item)
+            self.cancel_background_tasks()  # Drop a URL lookup started before
 
             if url.startswith("http"):  # It's a YouTube video
-                video_hash = hashlib.md5(url.encode()).hexdigest()
-                cached_video_path = os.path.join(self.cache_dir, f"{video_hash}.mp4")
-
-                if os.path.exists(cached_video_path):
-                    logging.info(f"Playing cached video: {cached_video_path}")
-                    self.play_local_video(cached_video_path)
-                else:
+                if not self.play_from_cache(url, audio_only=audio_only):
                     logging.info(f"Video not cached, downloading: {url}")
                     # Download the video and play it
-                    self.download_and_play_first_video(url, cached_video_path)
+                    self.download_and_play_first_video(url, audio_only)
+
+                # The user may have jumped: move the queued downloads around the new current item
+                self.queue_playlist_downloads()
             else:
                 # It's a local file, play it directly
                 logging.info(f"Playing local video: {url}")
-                self.play_local_video(url)
+                self.play_local_video(url, audio_only)
 
     def on_playlist_select(self, event=None):
+        self.telemetry.request()
         if self.cache_var.get():
             self.play_selected_item_cached(event)
         else:
             self.play_selected_item_noncached(event)
 
     def on_video_end(self):
+        self.telemetry.request()  # The time to first frame of the next item is the gap between the two
         current_index = self.playlist_listbox.curselection()
         if current_index:
-            next_index = current_index[0] + 1
-            if next_index < self.playlist_listbox.size():
-                self.playlist_listbox.selection_clear(0, tk.END)
-                self.playlist_listbox.selection_set(next_index)
-                self.playlist_listbox.activate(next_index)
+            next_index = self.get_next_playlist_index(current_index[0])
+            if next_index is not None:
+                self.select_playlist_index(next_index)
 
+                # Switch straight to the next item if it was prepared while this one played
+                if self.play_prepared_next(next_index):
+                    return
                 # Check if cache is enabled and play the next video accordingly
                 if self.cache_var.get():
                     self.play_selected_item_cached()
@@ -1029,36 +2141,225 @@ class VideoPlayer:
         else:
             self.stop_video()
 
-    def update_slider(self):
-        """Update the video slider and handle looping."""
+    def get_resume_key(self, url):
+        """Resume store key of an item: the video's cache key (shared by its cached copies), or the file path."""
+        if url.startswith("http"):
+            return self.get_cache_key(url)
+        path = os.path.abspath(url)
+        if os.path.dirname(path) == os.path.abspath(self.cache_dir):
+            return os.path.basename(path).split('.')[0]  # yt_<id>.mp4, yt_<id>.audio.m4a -> yt_<id>
+        return os.path.normcase(path)
+
+    def apply_resume_position(self, media, resume_key):
+        """Open the media of the item about to play at its saved position, if any, and track its position once
+        the player switched to it (see on_vlc_media_changed)."""
+        self.resume_key = None  # Until then, time ticks belong to the outgoing media
+        self.resume_key_pending = resume_key
+        position = self.resume_store.get(resume_key)
+        if position:
+            # Set on the media so VLC opens the input there, instead of playing from the start and seeking
+            media.add_option(f":start-time={position}")
+            logging.info(f"Resuming at {self.format_time(position)}: {resume_key}")
+
+    def start_telemetry(self, media, source, prepared=False):
+        """Close the telemetry record of the previous playback and open one for media, about to play.
+        source is cache, progressive, stream or local."""
+        self.telemetry.finish("switched")
+        self.telemetry.start(self.resume_key_pending, source, media, prepared)
+
+    def toggle_stats_overlay(self):
+        if self.stats_overlay_var.get():
+            if not self.stats_overlay_scheduled:
+                self.stats_overlay_scheduled = True
+                self.update_stats_overlay()
+        else:
+            self.player.video_set_marquee_int(vlc.VideoMarqueeOption.Enable, 0)
+
+    def update_stats_overlay(self):
+        """Draw the current playback's telemetry over the video with VLC's marquee, every second while enabled."""
+        if not self.stats_overlay_var.get():
+            self.stats_overlay_scheduled = False
+            return
+
+        record = self.telemetry.snapshot()
+        if record:
+            ttff = f"{record['ttff_ms']} ms" if record["ttff_ms"] is not None else "-"
+            text = (f"{record['source']}{' (prepared)' if record['prepared'] else ''} | first frame {ttff} | "
+                    f"rebuffers {record['rebuffer_count']} ({record['rebuffer_ms']} ms)")
+            if "decoded_video" in record:
+                text += (f" | frames {record['displayed_pictures']} shown, {record['lost_pictures']} dropped "
+                         f"of {record['decoded_video']} decoded")
+        else:
+            text = "Nothing playing"
         try:
-            if self.player.is_playing():
-                # Update the slider without calling the command function
-                self.video_slider.config(command="")
-                position = self.player.get_position() * 100
-                self.video_slider.set(position)
-                self.video_slider.config(command=self.on_slider_release)
-
-                # Update the timestamp
-                current_time = self.player.get_time() / 1000
-                total_time = self.player.get_length() / 1000
-                self.timestamp_label.config(text=f"{self.format_time(current_time)}/{self.format_time(total_time)}")
-
-                # Handle loop logic
-                if self.loop_enabled and self.loop_start is not None and self.loop_end is not None:
-                    if current_time >= self.loop_end:
-                        logging.info(f"Looping back to {self.loop_start} seconds")
-                        self.player.set_time(int(self.loop_start * 1000))  # Seek to start of loop
-
-                # Check if the video has finished playing
-                if abs(current_time - total_time) < 1:
-                    self.on_video_end()
+            self.player.video_set_marquee_string(vlc.VideoMarqueeOption.Text, text)
+            self.player.video_set_marquee_int(vlc.VideoMarqueeOption.Position, 5)  # Top left
+            self.player.video_set_marquee_int(vlc.VideoMarqueeOption.Size, 16)
+            self.player.video_set_marquee_int(vlc.VideoMarqueeOption.Timeout, 0)  # Stay until replaced
+            self.player.video_set_marquee_int(vlc.VideoMarqueeOption.Enable, 1)  # Again for each new video output
+        except Exception as e:
+            logging.error(f"Error updating the stats overlay: {e}")
+        self.root.after(1000, self.update_stats_overlay)
+
+    def flush_resume_positions(self):
+        self.resume_store.flush()
+        self.root.after(self.resume_flush_interval_s * 1000, self.flush_resume_positions)
+
+    def get_next_playlist_index(self, index):
+        """Index of the playlist item to play after the one at index, following the shuffle and repeat modes.
+        Returns None at the end of the playlist."""
+        if index >= len(self.playlist):
+            return None
+        if self.repeat_mode == "one":
+            return index
+        if self.shuffle_enabled:
+            order = self.get_shuffle_order(self.playlist[index])
+            position = next(i for i, item in enumerate(order) if item is self.playlist[index])
+            if position + 1 < len(order):
+                next_item = order[position + 1]
+            elif self.repeat_mode == "all":
+                next_item = order[0]  # Play the same shuffled order again
+            else:
+                return None
+            return next(i for i, item in enumerate(self.playlist) if item is next_item)
+
+        if index + 1 < len(self.playlist):
+            return index + 1
+        return 0 if self.repeat_mode == "all" else None
+
+    def get_shuffle_order(self, current_item):
+        """Return the shuffled play order, shuffling again (with the current item first) if the playlist changed."""
+        if {id(item) for item in self.shuffle_order} != {id(item) for item in self.playlist}:
+            rest = [item for item in self.playlist if item is not current_item]
+            self.shuffle_order = [current_item] + random.sample(rest, len(rest))
+        return self.shuffle_order
+
+    def cycle_repeat_mode(self):
+        """Switch repeat between off, all (wrap around) and one (repeat the current item)."""
+        modes = ["off", "all", "one"]
+        self.repeat_mode = modes[(modes.index(self.repeat_mode) + 1) % len(modes)]
+        logging.info(f"Repeat {self.repeat_mode}")
+        self.options_menu.entryconfig(self.repeat_index, label=f"Repeat ({self.repeat_mode})")
+        self.prepare_next_item()  # The next item may have changed
+
+    def toggle_shuffle(self):
+        self.shuffle_enabled = not self.shuffle_enabled
+        self.shuffle_order = []  # Shuffled again from the current item on
+        logging.info(f"Shuffle {'enabled' if self.shuffle_enabled else 'disabled'}")
+        self.options_menu.entryconfig(self.shuffle_index, label=f"Shuffle ({'on' if self.shuffle_enabled else 'off'})")
+        self.prepare_next_item()  # The next item may have changed
+
+    def attach_player_events(self):
+        """Drive the playback state from VLC events instead of polling the player."""
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerMediaChanged, self.on_vlc_media_changed)
+        events.event_attach(vlc.EventType.MediaPlayerTimeChanged, self.on_vlc_time_changed)
+        events.event_attach(vlc.EventType.MediaPlayerLengthChanged, self.on_vlc_length_changed)
+        events.event_attach(vlc.EventType.MediaPlayerBuffering, self.on_vlc_buffering)
+        events.event_attach(vlc.EventType.MediaPlayerVout, lambda event: self.telemetry.first_frame())
+        events.event_attach(vlc.EventType.MediaPlayerPlaying,
+                            lambda event: self.run_on_ui_thread(self.on_playback_state, "playing"))
+        events.event_attach(vlc.EventType.MediaPlayerPaused,
+                            lambda event: self.run_on_ui_thread(self.on_playback_state, "paused"))
+        events.event_attach(vlc.EventType.MediaPlayerStopped,
+                            lambda event: self.run_on_ui_thread(self.on_playback_state, "stopped"))
+        events.event_attach(vlc.EventType.MediaPlayerEndReached,
+                            lambda event: self.run_on_ui_thread(self.on_end_reached))
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError,
+                            lambda event: self.run_on_ui_thread(self.on_playback_error))
+
+    # The on_vlc_* handlers run on a VLC thread: they only record values or hand over to the Tk thread,
+    # calling back into libvlc from there can deadlock
+    def on_vlc_media_changed(self, event):
+        self.playback_time_ms = 0
+        self.playback_length_ms = 0
+        self.resume_key = self.resume_key_pending  # Time ticks from now on are the new media's
+
+    def on_vlc_time_changed(self, event):
+        self.playback_time_ms = event.u.new_time
+        self.telemetry.first_frame()  # Audio, or a reused video output, has no Vout event
+        if self.resume_key:
+            self.resume_store.update(self.resume_key, event.u.new_time / 1000, self.playback_length_ms / 1000)
+
+    def on_vlc_length_changed(self, event):
+        self.playback_length_ms = event.u.new_length
+
+    def on_vlc_buffering(self, event):
+        self.telemetry.buffering(event.u.new_cache)  # Timed here, the Tk thread may be behind
+        self.run_on_ui_thread(self.on_buffering, event.u.new_cache)
+
+    def on_playback_state(self, state):
+        self.playback_state = state
+        self.update_download_budget()
+        if state == "playing":
+            self.start_slider_updates()
+
+    def on_end_reached(self):
+        self.playback_state = "ended"
+        if self.resume_key:
+            self.resume_store.remove(self.resume_key)  # Finished, start from the beginning next time
+        self.telemetry.finish("ended")
+        self.update_download_budget()
+        self.on_video_end()
+
+    def on_playback_error(self):
+        self.playback_state = "error"
+        logging.error("VLC could not play the current media")
+        self.telemetry.finish("error")
+        if self.playback_source == "stream" and self.resume_key:
+            # Most likely its stream URL expired or was refused (403): extract it again the next time. For a
+            # video the resume key is its metadata key.
+            self.metadata_cache.invalidate(self.resume_key)
+        self.timestamp_label.config(text="Playback error")
+        self.update_download_budget()
+
+    def on_buffering(self, percent):
+        if self.playback_state == "playing" and percent < 100:
+            self.timestamp_label.config(text=f"Buffering {percent:.0f}%")
+
+    def start_slider_updates(self):
+        if not self.slider_update_scheduled:
+            self.slider_update_scheduled = True
+            self.root.after(0, self.update_slider)
+
+    def update_slider(self):
+        """Redraw the video slider and timestamp from the latest VLC time events.
 
+        Runs every slider_refresh_ms while playing and visible, and stops otherwise; the next Playing event or
+        the slider being shown again starts it."""
+        self.slider_update_scheduled = False
+        if self.playback_state != "playing" or not self.video_slider.winfo_viewable():
+            return
+
+        try:
+            current_time = max(0, self.playback_time_ms) / 1000
+            total_time = max(0, self.playback_length_ms) / 1000
+            # Update the slider without calling the command function
+            self.video_slider.config(command="")
+            self.video_slider.set(100 * current_time / total_time if total_time else 0)
+            self.video_slider.config(command=self.on_slider_release)
+
+            # Update the timestamp
+            self.timestamp_label.config(text=f"{self.format_time(current_time)}/{self.format_time(total_time)}")
         except Exception as e:
             logging.error(f"Error updating slider: {e}")
 
-        # Update every second
-        self.root.after(1000, self.update_slider)
+        self.slider_update_scheduled = True
+        self.root.after(self.slider_refresh_ms, self.update_slider)
+
+    def update_download_budget(self):
+        """Throttle cache downloads while a network stream is playing, full budget otherwise."""
+        if self.playback_source == "stream" and self.playback_state == "playing":
+            limits = [limit for limit in (self.download_rate_limit_kb_per_s,
+                                          self.streaming_download_rate_limit_kb_per_s) if limit]
+            rate = min(limits) * 1024 if limits else 0
+        else:
+            rate = self.download_rate_limit_kb_per_s * 1024
+
+        if rate != self.download_limiter.rate:
+            logging.info(f"Download rate limit set to {rate / 1024:.0f} KB/s" if rate
+                         else "Download rate limit removed")
+            self.download_limiter.set_rate(rate)
 
     def edit_playlist(self):
         edit_window = tk.Toplevel(self.root)
@@ -1461,15 +2762,16 @@ class VideoPlayer:
             messagebox.showerror("Error", "Failed to retrieve YouTube search results.")
 
     def is_video_downloadable(self, url):
-        ydl_opts = {'quiet': True}  # Suppress output
+        """Return True if the video has a format with both audio and video. Blocks, run it in the background."""
+        # Same options as streaming it, so the extracted info is reused when it is played
+        ydl_opts = dict(self.get_stream_ydl_opts(), quiet=True)  # Suppress output
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
-                formats = info_dict.get('formats', None)
-                if formats:
-                    # Filter for formats that have both video and audio
-                    downloadable_formats = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
-                    return bool(downloadable_formats)  # Return True if downloadable formats exist
+            info_dict = self.extract_info_cached(url, ydl_opts)
+            formats = info_dict.get('formats', None)
+            if formats:
+                # Filter for formats that have both video and audio
+                downloadable_formats = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+                return bool(downloadable_formats)  # Return True if downloadable formats exist
         except Exception as e:
             print(f"Failed to check downloadability for {url}: {e}")
         return False
@@ -1477,16 +2779,25 @@ class VideoPlayer:
     def add_search_result_to_playlist(self, results_listbox):
         selected_indices = results_listbox.curselection()
         if selected_indices:
-            for index in selected_indices:
-                selected_result = results_listbox.results[index]
-                if self.search_type_var.get() == "video":
-                    if self.is_video_downloadable(selected_result['url']):
-                        self.add_to_playlist(selected_result['url'], selected_result['title'])
-                    else:
-                        messagebox.showwarning("Download Error", f"'{selected_result['title']}' is not downloadable.")
-                elif self.search_type_var.get() == "playlist":
+            selected_results = [results_listbox.results[index] for index in selected_indices]
+            if self.search_type_var.get() == "video":
+                # Checking each video takes a yt-dlp extraction, do it in the background
+                self.run_in_background(
+                    lambda: [self.is_video_downloadable(result['url']) for result in selected_results],
+                    lambda downloadable: self.add_downloadable_results(selected_results, downloadable),
+                    cancellable=False)
+            elif self.search_type_var.get() == "playlist":
+                for selected_result in selected_results:
                     # Directly handle the playlist URL as if it was entered in the YouTube URL box
-                    self.handle_playlist_url(selected_result['url'])
+                    # (several selected playlists must not supersede each other)
+                    self.handle_playlist_url(selected_result['url'], cancellable=len(selected_results) == 1)
+
+    def add_downloadable_results(self, selected_results, downloadable):
+        for selected_result, is_downloadable in zip(selected_results, downloadable):
+            if is_downloadable:
+                self.add_to_playlist(selected_result['url'], selected_result['title'])
+            else:
+                messagebox.showwarning("Download Error", f"'{selected_result['title']}' is not downloadable.")
 
     def load_favorites(self):
         """Load favorites from a JSON file."""
@@ -1669,7 +2980,7 @@ class VideoPlayer:
         # Handle the window close event to ensure no changes are saved if the user closes the window
         edit_window.protocol("WM_DELETE_WINDOW", lambda: edit_window.destroy())
 
-    def handle_playlist_url(self, url):
+    def handle_playlist_url(self, url, cancellable=True):
         """Handles a YouTube playlist URL by invoking the existing logic for YouTube URL input."""
         # Clear the URL entry box and insert the playlist URL
         self.url_entry.delete(0, tk.END)
@@ -1677,9 +2988,9 @@ class VideoPlayer:
 
         # Trigger the existing logic to handle this URL, respecting the cached option
         if self.cache_var.get() == 1:
-            self.play_youtube_video_cached()
+            self.play_youtube_video_cached(cancellable=cancellable)
         else:
-            self.play_youtube_video_noncached()
+            self.play_youtube_video_noncached(cancellable=cancellable)
 
     def add_hover_tooltips(self, results_listbox, show_details_var):
         # Create a label for displaying the tooltip
@@ -1752,7 +3063,8 @@ class VideoPlayer:
 
     def on_closing(self):
         try:
-            # Stop the player before closing the app
+            # Record the playback still going, then stop the player before closing the app
+            self.telemetry.finish("closed")
             if self.player.is_playing():
                 self.player.stop()
 
@@ -1776,6 +3088,15 @@ class VideoPlayer:
             # Temporarily suppress stderr to avoid Tkinter __del__ errors
             sys.stderr = open(os.devnull, 'w')
 
+            # Let the download workers stop cleanly (their queue stays in the journal), save the resume
+            # positions, stop serving in-progress downloads and close the cache index database
+            self.download_manager.shutdown()
+            self.loop_enforcer.shutdown()
+            self.resume_store.flush()
+            self.background_executor.shutdown(wait=False, cancel_futures=True)
+            self.stream_server.shutdown()
+            self.cache_index.close()
+
             # Destroy the main window
             self.root.destroy()
 
@@ -1827,6 +3148,1072 @@ class ToolTip:
             self.tipwindow.destroy()
         self.tipwindow = None
 
+class BandwidthLimiter:
+    """Token bucket shared by the download workers to cap their aggregate rate (bytes/s, 0 = unlimited)."""
+
+    BURST_SECONDS = 1.0
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.next_free = time.monotonic()  # When the bytes consumed so far have been paid for
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.next_free = time.monotonic()
+
+    def consume(self, nbytes):
+        """Account for nbytes just downloaded, sleeping long enough to keep every caller within the rate."""
+        with self.lock:
+            if not self.rate or not nbytes:
+                return
+            now = time.monotonic()
+            start = max(self.next_free, now - self.BURST_SECONDS)
+            self.next_free = start + nbytes / self.rate
+            delay = self.next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, and a maximum number of attempts per error class."""
+
+    BASE_DELAY = 2  # Seconds before the first retry, at most
+    MAX_DELAY = 300
+    MAX_ATTEMPTS = {
+        "network": 6,  # Timeouts, resets, DNS, 5xx, expired 403 links: likely to work later
+        "throttled": 5,  # HTTP 429
+        "corrupt": 3,  # Failed verify_download
+        "disk": 1,  # Local file errors (no space, permissions, missing directory): retrying won't fix them
+        "unavailable": 1,  # Private, removed or region locked
+        "other": 3,
+    }
+    # yt-dlp's messages for videos that can't be had, not "Requested format is not available"
+    UNAVAILABLE_MARKERS = ("video unavailable", "private video", "this video is private", "has been removed",
+                           "no longer available", "this video is not available", "not available in your country",
+                           "http error 404", "sign in to confirm", "members-only", "unsupported url")
+    NETWORK_MARKERS = ("timed out", "timeout", "connection", "getaddrinfo", "name resolution", "unreachable",
+                       "http error 5", "http error 403", "remote end closed", "incompleteread",
+                       "unable to download", "ssl")
+
+    def classify(self, error):
+        """Return the error class of a download or extraction error."""
+        message = str(error).lower()
+        if isinstance(error, ValueError):
+            return "corrupt"
+        if "no space left" in message or "disk full" in message:
+            return "disk"
+        if "http error 429" in message or "too many requests" in message:
+            return "throttled"
+        if any(marker in message for marker in self.UNAVAILABLE_MARKERS):
+            return "unavailable"
+        if (isinstance(error, (ConnectionError, TimeoutError, urllib.error.URLError))
+                or any(marker in message for marker in self.NETWORK_MARKERS)):
+            return "network"
+        if isinstance(error, OSError):
+            return "disk"  # e.g. the cache file can't be replaced or the partial directory is gone
+        return "other"
+
+    def max_attempts(self, error_class):
+        return self.MAX_ATTEMPTS.get(error_class, self.MAX_ATTEMPTS["other"])
+
+    def delay(self, attempt, max_delay=None):
+        """Random delay before retry number attempt (1-based): full jitter over an exponential cap."""
+        cap = min(max_delay or self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+class DownloadJob:
+    def __init__(self, url, key, priority, limiter=None, options=None):
+        self.url = url
+        self.key = key
+        self.priority = priority
+        self.options = options or {}  # e.g. {"upgrade": True} to replace an existing cached copy
+        self.limiter = limiter  # Shared BandwidthLimiter, or None
+        self.seq = 0  # Sequence number of the job's live heap entry
+        self.cancelled = threading.Event()
+        self.preempted = False  # Cancelled to make room for a foreground download, will be requeued
+        self.state = "queued"  # queued, downloading, finished, failed or cancelled
+        self.downloaded_bytes = 0
+        self.total_bytes = None  # Exact size, when the server reports one
+        self.total_bytes_estimate = None
+        self.tmpfilename = None  # File yt-dlp is writing to
+        self.filename = None  # File yt-dlp renames it to when done
+        self.final_path = None  # Path in the cache once verified
+        self.speed = None  # Bytes per second
+        self.eta = None  # Seconds
+        self.started_at = None
+        self.finished_at = None
+        self.attempts = 0  # Failed attempts so far
+        self.error = None  # Exception of the last failed attempt
+        self.error_class = None
+        self.retry_at = None  # time.monotonic() of the next attempt while retrying
+        self.done = threading.Event()  # Set once the job finished, failed or was cancelled
+        self.callbacks = []  # Called with the job when it is done, on the worker thread
+
+    def progress_hook(self, progress):
+        """yt-dlp progress hook: record progress and abort the download if the job was cancelled."""
+        if self.cancelled.is_set():
+            raise yt_dlp.utils.DownloadCancelled(f"Download cancelled: {self.url}")
+
+        downloaded_bytes = progress.get('downloaded_bytes') or self.downloaded_bytes
+        if self.limiter and progress.get('status') == 'downloading':
+            # Sleeping in the hook holds back this download's next read
+            self.limiter.consume(max(0, downloaded_bytes - self.downloaded_bytes))
+
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = progress.get('total_bytes') or self.total_bytes
+        self.total_bytes_estimate = progress.get('total_bytes_estimate') or self.total_bytes_estimate
+        self.speed = progress.get('speed')
+        self.eta = progress.get('eta')
+        self.tmpfilename = progress.get('tmpfilename') or self.tmpfilename
+        self.filename = progress.get('filename') or self.filename
+
+    def to_dict(self):
+        """Progress snapshot of the job."""
+        return {
+            "url": self.url,
+            "key": self.key,
+            "state": self.state,
+            "priority": self.priority,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes or self.total_bytes_estimate,
+            "speed": self.speed,
+            "eta": self.eta,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "attempts": self.attempts,
+            "error": str(self.error) if self.error else None,
+            "error_class": self.error_class,
+            "retry_in": max(0, self.retry_at - time.monotonic()) if self.retry_at else None,
+        }
+
+class DownloadManager:
+    """Bounded pool of worker threads running download jobs in priority order (lower value first)."""
+
+    PRIORITY_CURRENT = 0
+    PRIORITY_NEXT = 1
+    PRIORITY_BACKGROUND = 2
+    JOURNAL_NAME = "download_queue.json"
+    JOURNAL_DELAY = 1  # Seconds the queue may keep changing before it is saved, a playlist load is one write
+
+    def __init__(self, download_func, workers=2, limiter=None, journal_path=None, retry_policy=None):
+        self.download_func = download_func  # Called with the job on a worker thread, sets state "failed" on error
+        self.limiter = limiter  # Aggregate bandwidth budget shared by all workers
+        self.journal_path = journal_path  # Queued and running jobs are saved here, None to not persist
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.heap = []  # (priority, seq, key); stale entries are skipped when popped
+        self.seq = itertools.count()
+        self.pending = {}  # key -> queued job
+        self.running = {}  # key -> job being downloaded
+        self.retrying = {}  # key -> failed job waiting out its backoff delay
+        self.dead_letters = collections.OrderedDict()  # key -> job that ran out of attempts, oldest first
+        self.history = collections.deque(maxlen=100)  # Recently finished, failed or cancelled jobs
+        self.last_sample = (time.monotonic(), {})  # Used by throughput_sample
+        self.journal_dirty = threading.Event()  # Set when the queue changed since the journal was written
+        self.journal_stop = threading.Event()
+
+        self.journal_thread = None
+        if self.journal_path:
+            self.journal_thread = threading.Thread(target=self.journal_writer, name="download-journal", daemon=True)
+            self.journal_thread.start()
+
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.worker, name=f"download-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, url, key, priority, on_done=None, options=None):
+        """Queue a download and return its job.
+
+        Requests for a key that is already queued or downloading attach to that job instead of starting a
+        second transfer: a queued job is reprioritized, and on_done is called when the shared job is done."""
+        with self.condition:
+            job = self.find_locked(key)
+            if job:
+                logging.debug(f"Attaching to in-flight download ({job.state}): {url}")
+                self.reprioritize_locked(job, priority)
+            else:
+                self.dead_letters.pop(key, None)  # Asked for again, start over
+                job = DownloadJob(url, key, priority, self.limiter, options)
+                self.pending[key] = job
+                self.push_locked(job)
+                if priority == self.PRIORITY_CURRENT:
+                    self.preempt_locked()
+
+            if on_done and not job.done.is_set():
+                job.callbacks.append(on_done)
+                on_done = None
+            self.mark_journal_dirty_locked()
+
+        if on_done:
+            on_done(job)  # Finished between the lookup and now
+        return job
+
+    def find(self, key):
+        """Return the queued or running job for a key, or None."""
+        with self.condition:
+            return self.find_locked(key)
+
+    def find_locked(self, key):
+        return self.pending.get(key) or self.running.get(key) or self.retrying.get(key)
+
+    def snapshot(self):
+        """Return progress dicts for running, queued (in priority order), retrying and recently finished jobs."""
+        with self.condition:
+            running = [job.to_dict() for job in self.running.values()]
+            pending = [job.to_dict() for job in sorted(self.pending.values(), key=lambda job: job.priority)]
+            retrying = [job.to_dict() for job in sorted(self.retrying.values(), key=lambda job: job.retry_at)]
+            finished = [job.to_dict() for job in reversed(self.history)]
+        return running + pending + retrying + finished
+
+    def dead_letter_snapshot(self):
+        """Return progress dicts for the jobs that ran out of attempts, most recent first."""
+        with self.condition:
+            return [job.to_dict() for job in reversed(self.dead_letters.values())]
+
+    def is_dead_letter(self, key):
+        with self.condition:
+            return key in self.dead_letters
+
+    def retry_dead_letters(self):
+        """Queue every job that ran out of attempts again, with a fresh attempt count."""
+        with self.condition:
+            jobs = list(self.dead_letters.values())
+            self.dead_letters.clear()
+        for job in jobs:
+            self.submit(job.url, job.key, max(job.priority, self.PRIORITY_NEXT), options=job.options)
+
+    def clear_dead_letters(self):
+        with self.condition:
+            self.dead_letters.clear()
+
+    def throughput_sample(self):
+        """Return the aggregate download rate in bytes/s since the previous call."""
+        with self.condition:
+            jobs = list(self.running.values()) + list(self.history)
+        now = time.monotonic()
+        last_time, last_bytes = self.last_sample
+        current_bytes = {id(job): job.downloaded_bytes for job in jobs}
+        downloaded = sum(max(0, size - last_bytes.get(job_id, 0)) for job_id, size in current_bytes.items())
+        self.last_sample = (now, current_bytes)
+        return downloaded / max(now - last_time, 0.001)
+
+    def reprioritize_locked(self, job, priority):
+        if job.key in self.retrying:
+            job.priority = min(job.priority, priority)
+            if priority == self.PRIORITY_CURRENT:
+                # The user is waiting for it now, skip the rest of the backoff delay
+                job.retry_at = time.monotonic()
+                self.condition.notify()
+        elif job.key not in self.pending:
+            # Already running, only remember the priority in case it gets preempted
+            job.priority = min(job.priority, priority)
+        elif job.priority != priority:
+            job.priority = priority
+            self.push_locked(job)
+            if priority == self.PRIORITY_CURRENT:
+                self.preempt_locked()
+
+    def preempt_locked(self):
+        """Free a worker for the current item by pausing the lowest priority running download."""
+        if len(self.running) < len(self.threads):
+            return
+        victim = max(self.running.values(), key=lambda job: job.priority)
+        if victim.priority > self.PRIORITY_CURRENT and not victim.cancelled.is_set():
+            logging.info(f"Pausing background download to start the current item first: {victim.url}")
+            victim.preempted = True
+            victim.cancelled.set()
+
+    def push_locked(self, job):
+        job.seq = next(self.seq)
+        heapq.heappush(self.heap, (job.priority, job.seq, job.key))
+        self.condition.notify()
+
+    def cancel(self, key):
+        """Drop a queued job or abort a running one."""
+        with self.condition:
+            job = self.pending.pop(key, None) or self.retrying.pop(key, None)
+            if job:
+                self.finish_cancelled_locked(job)
+                self.mark_journal_dirty_locked()
+            job = self.running.get(key)
+            if job:
+                job.cancelled.set()
+
+    def finish_cancelled_locked(self, job):
+        """Mark a job dropped from the queue as done and notify its waiters."""
+        job.state = "cancelled"
+        job.finished_at = time.time()
+        self.history.append(job)
+        job.done.set()
+        callbacks, job.callbacks = job.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                logging.error(f"Error in download callback for {job.url}: {e}")
+
+    def cancel_all(self, keep=()):
+        """Cancel every queued and running job except those for the keys in keep."""
+        with self.condition:
+            for key in list(self.pending):
+                if key not in keep:
+                    self.finish_cancelled_locked(self.pending.pop(key))
+            for key in list(self.retrying):
+                if key not in keep:
+                    self.finish_cancelled_locked(self.retrying.pop(key))
+            for job in self.running.values():
+                if job.key not in keep:
+                    job.cancelled.set()
+            self.mark_journal_dirty_locked()
+
+    def mark_journal_dirty_locked(self):
+        """Have the journal writer save the queue shortly, once for a whole burst of changes."""
+        if self.journal_path and not self.stopping:
+            self.journal_dirty.set()
+
+    def journal_writer(self):
+        while True:
+            self.journal_dirty.wait()
+            if self.journal_stop.wait(self.JOURNAL_DELAY):
+                return  # shutdown writes the final state
+            with self.condition:
+                if self.stopping:
+                    return
+                self.journal_dirty.clear()
+                entries = self.journal_entries_locked()
+            self.write_journal(entries)
+
+    def journal_entries_locked(self):
+        jobs = sorted(list(self.running.values()) + list(self.pending.values()) + list(self.retrying.values()),
+                      key=lambda job: (job.priority, job.seq))
+        return [{"url": job.url, "key": job.key, "priority": job.priority, "options": job.options}
+                for job in jobs]
+
+    def write_journal(self, entries):
+        """Write the queued and running jobs to the journal, replacing it atomically."""
+        temp_path = self.journal_path + ".tmp"
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(entries, file)
+            os.replace(temp_path, self.journal_path)
+        except OSError as e:
+            logging.error(f"Error saving the download queue: {e}")
+
+    def restore_journal(self):
+        """Queue the jobs saved in the journal by the previous session. Returns how many were restored."""
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return 0
+        try:
+            with open(self.journal_path, 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading the download queue: {e}")
+            return 0
+
+        for entry in entries:
+            # Nothing is playing yet, so the item that was current is only next in line now
+            priority = max(entry.get("priority", self.PRIORITY_BACKGROUND), self.PRIORITY_NEXT)
+            self.submit(entry["url"], entry["key"], priority, options=entry.get("options"))
+        return len(entries)
+
+    def shutdown(self, timeout=5):
+        """Stop the workers. Running downloads stop after the chunk being written and stay in the journal."""
+        with self.condition:
+            entries = self.journal_entries_locked() if self.journal_path else None
+            self.stopping = True  # Freezes the journal
+            for job in self.running.values():
+                job.preempted = True
+                job.cancelled.set()
+            self.condition.notify_all()
+
+        deadline = time.monotonic() + timeout
+        if self.journal_thread:
+            self.journal_stop.set()
+            self.journal_dirty.set()
+            self.journal_thread.join(max(0, deadline - time.monotonic()))
+            self.write_journal(entries)
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in self.threads):
+            logging.warning("Download workers did not stop in time, their partial downloads resume on the next start")
+
+    def schedule_retry_locked(self, job):
+        """Put a failed job back after a backoff delay. Returns False if it ran out of attempts."""
+        job.attempts += 1
+        job.error_class = self.retry_policy.classify(job.error)
+        if job.attempts >= self.retry_policy.max_attempts(job.error_class):
+            logging.error(f"Giving up on {job.url} after {job.attempts} attempt(s) ({job.error_class}): {job.error}")
+            self.dead_letters[job.key] = job
+            while len(self.dead_letters) > 100:
+                self.dead_letters.popitem(last=False)
+            return False
+
+        delay = self.retry_policy.delay(job.attempts)
+        logging.warning(f"Download failed ({job.error_class}), retrying in {delay:.1f} s: {job.url}")
+        job.state = "retrying"
+        job.retry_at = time.monotonic() + delay
+        self.retrying[job.key] = job
+        self.condition.notify()  # A waiting worker has to shorten its wait
+        return True
+
+    def queue_due_retries_locked(self):
+        """Move retrying jobs whose backoff delay is over back into the queue. Returns seconds to the next one."""
+        now = time.monotonic()
+        for key, job in list(self.retrying.items()):
+            if job.retry_at <= now:
+                del self.retrying[key]
+                job.state = "queued"
+                job.retry_at = None
+                self.pending[key] = job
+                self.push_locked(job)
+        return min((job.retry_at - now for job in self.retrying.values()), default=None)
+
+    def next_job_locked(self):
+        while self.heap:
+            priority, seq, key = heapq.heappop(self.heap)
+            job = self.pending.get(key)
+            if job and job.seq == seq:
+                del self.pending[key]
+                return job
+        return None
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while not self.stopping:
+                    retry_wait = self.queue_due_retries_locked()
+                    job = self.next_job_locked()
+                    if job:
+                        break
+                    self.condition.wait(retry_wait)
+                if self.stopping:
+                    return
+                self.running[job.key] = job
+
+            try:
+                self.download_func(job)
+            except Exception as e:
+                job.state = "failed"
+                job.error = e
+                logging.error(f"Error in download worker for {job.url}: {e}")
+            finally:
+                callbacks = []
+                with self.condition:
+                    if self.running.get(job.key) is job:
+                        del self.running[job.key]
+                    if job.preempted:
+                        job.preempted = False
+                        job.cancelled.clear()
+                        if not self.stopping:
+                            # Resume it later from its .part file
+                            self.pending[job.key] = job
+                            self.push_locked(job)
+                    elif (job.state == "failed" and not job.cancelled.is_set() and not self.stopping
+                          and self.schedule_retry_locked(job)):
+                        pass  # Back in the queue after its backoff delay
+                    else:
+                        job.finished_at = time.time()
+                        self.history.append(job)
+                        job.done.set()
+                        callbacks, job.callbacks = job.callbacks, []
+                        self.mark_journal_dirty_locked()
+
+                # Notify everyone who attached to this download
+                for callback in callbacks:
+                    try:
+                        callback(job)
+                    except Exception as e:
+                        logging.error(f"Error in download callback for {job.url}: {e}")
+
+class ProgressiveStreamServer:
+    """Local HTTP server that streams a download to VLC while it is still being written.
+
+    Reads block until the requested bytes are on disk, so VLC buffers instead of hitting a premature end of
+    file. Files are opened per chunk, so renames by yt-dlp and the cache are not blocked by an open handle."""
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, lookup):
+        self.lookup = lookup  # cache key -> (job, candidate paths) or None
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle_get(self)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Progressive stream: {format % args}")
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, name="progressive-stream", daemon=True).start()
+
+    def url_for(self, key):
+        return f"http://127.0.0.1:{self.port}/{key}"
+
+    def read_chunk(self, paths, position, size):
+        """Read from the first existing candidate file. Returns b'' if the bytes aren't written yet."""
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    f.seek(position)
+                    return f.read(min(size, self.CHUNK_SIZE))
+            except FileNotFoundError:
+                continue
+        return b""
+
+    def handle_get(self, request):
+        found = self.lookup(request.path.strip('/'))
+        if not found:
+            request.send_error(404)
+            return
+        job, paths = found
+
+        total = job.total_bytes
+        start, end = 0, (total - 1 if total else None)
+        match = re.match(r"bytes=(\d*)-(\d*)", request.headers.get("Range", ""))
+        if total and match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), total - 1)
+            else:
+                start = max(0, total - int(match.group(2)))  # Suffix range: the last N bytes
+            if start >= total:
+                request.send_response(416)
+                request.send_header("Content-Range", f"bytes */{total}")
+                request.end_headers()
+                return
+            request.send_response(206)
+            request.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+        else:
+            request.send_response(200)
+
+        request.send_header("Content-Type", "video/mp4")
+        if total:
+            request.send_header("Accept-Ranges", "bytes")
+            request.send_header("Content-Length", str(end - start + 1))
+        request.end_headers()
+
+        position = start
+        try:
+            while end is None or position <= end:
+                size = self.CHUNK_SIZE if end is None else end - position + 1
+                data = self.read_chunk(paths, position, size)
+                if data:
+                    request.wfile.write(data)
+                    position += len(data)
+                    continue
+
+                if job.state == "finished":
+                    # The file may have been between two names, read once more before giving up
+                    data = self.read_chunk(paths, position, size)
+                    if not data:
+                        break
+                    request.wfile.write(data)
+                    position += len(data)
+                elif job.state in ("failed", "cancelled"):
+                    break
+                else:
+                    time.sleep(0.1)  # Wait for the download to catch up
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass  # VLC closed the connection, e.g. to seek
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class LoopEnforcer:
+    """Thread that keeps playback inside an A-B loop, seeking back to the loop start within a frame of the end.
+
+    VLC's reported time only advances in coarse steps, so the playback time is extrapolated from the last
+    step with the wall clock and the playback rate, and checked every few milliseconds near the loop end."""
+
+    IDLE_INTERVAL = 0.25  # Seconds between checks while paused; without a loop the thread waits for set_loop
+    FINE_INTERVAL = 0.002  # Seconds between checks close to the loop end
+    # Seconds of playback before the loop end when fine checks start: long enough to see a few of VLC's time
+    # steps as they happen, so the extrapolation starts from an accurate one
+    FINE_WINDOW = 1
+    SEEK_SETTLE_TIMEOUT = 1  # Max seconds to wait for VLC to report the time after a seek
+    DEFAULT_FPS = 30
+
+    def __init__(self, player):
+        self.player = player
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.loop = None  # (start ms, end ms) while looping
+        self.stopping = False
+        self.overshoots = collections.deque(maxlen=50)  # Recent overshoots VLC reported, in ms, for the log
+        self.thread = threading.Thread(target=self.run, name="loop-enforcer", daemon=True)
+        self.thread.start()
+
+    def set_loop(self, start, end):
+        """Loop between start and end (seconds), or stop looping if either is None."""
+        with self.lock:
+            if start is not None and end is not None and end > start:
+                self.loop = (int(start * 1000), int(end * 1000))
+            else:
+                self.loop = None
+            self.overshoots.clear()
+        self.wake.set()
+
+    def shutdown(self):
+        self.stopping = True
+        self.wake.set()
+        self.thread.join(1)
+
+    def get_frame_ms(self):
+        try:
+            fps = self.player.get_fps()
+        except Exception:
+            fps = 0
+        return 1000 / (fps if fps and fps > 0 else self.DEFAULT_FPS)
+
+    def sleep(self, seconds=None):
+        """Wait for seconds, or until set_loop or shutdown is called (without seconds, only for those)."""
+        self.wake.wait(seconds)
+        self.wake.clear()
+
+    def run(self):
+        last_time = None  # Last time VLC reported, in ms
+        last_change = 0  # time.monotonic() when it changed
+        while not self.stopping:
+            with self.lock:
+                loop = self.loop
+            try:
+                if not loop:
+                    last_time = None
+                    self.sleep()
+                    continue
+                if not self.player.is_playing():
+                    last_time = None
+                    self.sleep(self.IDLE_INTERVAL)
+                    continue
+
+                now = time.monotonic()
+                rate = self.player.get_rate() or 1
+                vlc_time = self.player.get_time()
+                if vlc_time != last_time:
+                    last_time, last_change = vlc_time, now
+                estimate = last_time + (now - last_change) * 1000 * rate
+
+                start_ms, end_ms = loop
+                if estimate >= end_ms - self.get_frame_ms() / 2:
+                    self.player.set_time(start_ms)
+                    # What VLC itself reported at the seek (and how long ago it changed), not the estimate
+                    # that triggered it
+                    reported_age_ms = (time.monotonic() - last_change) * 1000
+                    landed_ms = self.wait_for_seek(end_ms)
+                    self.record_overshoot(last_time - end_ms, reported_age_ms, landed_ms, start_ms, end_ms)
+                    last_time = None
+                    continue
+
+                remaining = (end_ms - estimate) / 1000 / rate
+                self.sleep(self.FINE_INTERVAL if remaining < self.FINE_WINDOW
+                           else min(self.IDLE_INTERVAL, remaining - self.FINE_WINDOW))
+            except Exception as e:
+                logging.error(f"Error enforcing the A-B loop: {e}")
+                self.sleep(self.IDLE_INTERVAL)
+
+    def wait_for_seek(self, end_ms):
+        """Wait until VLC reports a time before the loop end again, so the old time doesn't trigger a second seek.
+        Returns that time in ms, or None if VLC didn't report one in time."""
+        deadline = time.monotonic() + self.SEEK_SETTLE_TIMEOUT
+        while time.monotonic() < deadline and not self.stopping:
+            vlc_time = self.player.get_time()
+            if vlc_time < end_ms:
+                return vlc_time
+            self.sleep(self.FINE_INTERVAL)
+        return None
+
+    def record_overshoot(self, overshoot_ms, reported_age_ms, landed_ms, start_ms, end_ms):
+        self.overshoots.append(overshoot_ms)
+        worst = max(self.overshoots, key=abs)
+        landed = f"{landed_ms - start_ms:+.0f} ms from the loop start" if landed_ms is not None else "not reported"
+        logging.info(f"A-B loop: VLC reported {overshoot_ms:+.0f} ms from loop end {end_ms / 1000:.3f} s at the seek "
+                     f"(reading {reported_age_ms:.0f} ms old), landed {landed} (frame {self.get_frame_ms():.1f} ms, "
+                     f"worst of last {len(self.overshoots)}: {worst:+.0f} ms)")
+
+class MetadataCache:
+    """Thread-safe in-memory cache of yt-dlp info dicts, each kept until its stream URLs expire."""
+
+    # YouTube stream URLs carry their expiry time as ...&expire=<unix time>&... or .../expire/<unix time>/...
+    EXPIRE_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+    EXPIRE_MARGIN = 60  # Seconds before expiry after which a URL is too close to expiring to start playing
+    MAX_ENTRIES = 200
+
+    def __init__(self, default_ttl=600):
+        self.default_ttl = default_ttl  # For info without expiring URLs (e.g. flat playlists)
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> (expires_at, info_dict), least recently used first
+
+    def get(self, key):
+        """Return the cached info dict for a key, or None if there is none or it expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            expires_at, info_dict = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return info_dict
+
+    def put(self, key, info_dict):
+        ttl = self.get_ttl(info_dict)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, info_dict)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, metadata_key):
+        """Drop the info of a URL in every flavour it was extracted in (flat or not, any format)."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == metadata_key]:
+                del self.entries[key]
+
+    def get_ttl(self, info_dict):
+        """Seconds the info stays usable: until its earliest stream URL expires, else the default TTL."""
+        urls = [info_dict.get('url')]
+        urls += [fmt.get('url') for fmt in info_dict.get('requested_formats') or []]
+        for entry in info_dict.get('entries') or []:
+            if entry:
+                urls.append(entry.get('url'))
+        expiry_times = [int(match.group(1)) for url in urls if url
+                        for match in [self.EXPIRE_PATTERN.search(url)] if match]
+        if expiry_times:
+            return min(expiry_times) - self.EXPIRE_MARGIN - time.time()
+        return self.default_ttl
+
+class ResumeStore:
+    """Playback positions by item key, updated in memory on every time tick and written to disk in batches."""
+
+    MIN_POSITION_S = 10  # Positions closer to the start are not worth resuming
+    END_MARGIN_S = 15  # Positions this close to the end count as finished
+    MAX_ENTRIES = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # Updated from the VLC event thread, flushed from the Tk thread
+        self.dirty = False
+        self.positions = collections.OrderedDict()  # key -> position in seconds, least recently played first
+        try:
+            with open(self.path, 'r') as file:
+                self.positions.update(json.load(file))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading resume positions: {e}")
+
+    def get(self, key):
+        with self.lock:
+            return self.positions.get(key)
+
+    def update(self, key, position, length=0):
+        """Record the position of an item, forgetting it once the item is (nearly) finished."""
+        if position < self.MIN_POSITION_S:
+            return  # Also skips the zero ticks before a start offset takes effect
+        if length and position >= length - self.END_MARGIN_S:
+            self.remove(key)
+            return
+        with self.lock:
+            self.positions[key] = round(position, 1)
+            self.positions.move_to_end(key)
+            while len(self.positions) > self.MAX_ENTRIES:
+                self.positions.popitem(last=False)
+            self.dirty = True
+
+    def remove(self, key):
+        with self.lock:
+            if self.positions.pop(key, None) is not None:
+                self.dirty = True
+
+    def flush(self):
+        """Write the positions if they changed since the last flush, replacing the file atomically."""
+        with self.lock:
+            if not self.dirty:
+                return
+            positions = dict(self.positions)
+            self.dirty = False
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(positions, file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.error(f"Error saving resume positions: {e}")
+            with self.lock:
+                self.dirty = True  # Try again on the next flush
+
+class PlaybackTelemetry:
+    """Quality of service record of each playback: time from the user's request to the first frame, rebuffers
+    and VLC's decoder stats, written as JSON lines to a rotating file."""
+
+    FILE_NAME = "playback_telemetry.jsonl"
+    BACKUP_COUNT = 3
+
+    def __init__(self, path, max_bytes):
+        self.lock = threading.Lock()  # Events arrive on the VLC thread, records start and end on the Tk thread
+        self.requested_at = None
+        self.session = None
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=self.BACKUP_COUNT)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.getLogger("telemetry")
+        self.logger.propagate = False  # Keep the records out of video_player.log
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+
+    def request(self):
+        """Mark the moment the user asked for something to play; the time to first frame counts from here."""
+        with self.lock:
+            self.requested_at = time.monotonic()
+
+    def start(self, key, source, media, prepared=False):
+        with self.lock:
+            requested_at, self.requested_at = self.requested_at, None
+            self.session = {"key": key, "source": source, "prepared": prepared, "media": media,
+                            "started": time.time(), "requested_at": requested_at or time.monotonic(),
+                            "ttff_ms": None, "rebuffer_count": 0, "rebuffer_ms": 0, "rebuffering_since": None}
+
+    def first_frame(self):
+        with self.lock:
+            if self.session and self.session["ttff_ms"] is None:
+                self.session["ttff_ms"] = round((time.monotonic() - self.session["requested_at"]) * 1000)
+
+    def buffering(self, percent):
+        """Count a rebuffer from the first buffering event after the first frame until the buffer is full."""
+        with self.lock:
+            session = self.session
+            if not session or session["ttff_ms"] is None:
+                return  # Buffering before the first frame is part of the time to first frame
+            if percent < 100 and session["rebuffering_since"] is None:
+                session["rebuffering_since"] = time.monotonic()
+                session["rebuffer_count"] += 1
+            elif percent >= 100 and session["rebuffering_since"] is not None:
+                session["rebuffer_ms"] += round((time.monotonic() - session["rebuffering_since"]) * 1000)
+                session["rebuffering_since"] = None
+
+    def snapshot(self):
+        """Return the record of the current playback so far, or None if nothing is playing."""
+        with self.lock:
+            session = dict(self.session) if self.session else None
+        return self.build_record(session) if session else None
+
+    def finish(self, outcome):
+        """Write the record of the current playback. outcome is ended, switched, stopped, error or closed."""
+        with self.lock:
+            session, self.session = self.session, None
+        if not session:
+            return
+        record = self.build_record(session)
+        record["outcome"] = outcome
+        self.logger.info(json.dumps(record))
+
+    def build_record(self, session):
+        rebuffer_ms = session["rebuffer_ms"]
+        if session["rebuffering_since"] is not None:
+            rebuffer_ms += round((time.monotonic() - session["rebuffering_since"]) * 1000)
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(session["started"])),
+                  "key": session["key"], "source": session["source"], "prepared": session["prepared"],
+                  "ttff_ms": session["ttff_ms"], "rebuffer_count": session["rebuffer_count"],
+                  "rebuffer_ms": rebuffer_ms, "duration_s": round(time.time() - session["started"], 1)}
+        record.update(self.get_media_stats(session["media"]))
+        return record
+
+    def get_media_stats(self, media):
+        """Return VLC's decoded/shown/dropped counters of a media, or {} if it has none (yet)."""
+        stats = vlc.MediaStats()
+        try:
+            if not media.get_stats(stats):
+                return {}
+        except Exception as e:
+            logging.debug(f"Could not read media stats: {e}")
+            return {}
+        return {"decoded_video": stats.decoded_video, "displayed_pictures": stats.displayed_pictures,
+                "lost_pictures": stats.lost_pictures, "decoded_audio": stats.decoded_audio,
+                "lost_audio_buffers": stats.lost_abuffers, "read_bytes": stats.read_bytes}
+
+class CacheIndex:
+    """Persistent SQLite index of the videos stored in the cache directory."""
+
+    DB_NAME = "cache_index.db"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()  # The connection is shared by the Tk thread and download threads
+        self.conn = sqlite3.connect(os.path.join(cache_dir, self.DB_NAME), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # Keep the rollback journal file around so index writes don't touch the directory mtime
+        self.conn.execute("PRAGMA journal_mode=PERSIST")
+
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    url TEXT,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    format TEXT,
+                    created REAL NOT NULL,
+                    last_played REAL,
+                    play_count INTEGER NOT NULL DEFAULT 0
+                )""")
+            columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(entries)")]
+            if "height" not in columns:
+                # Video height of the cached format, used to offer quality upgrades
+                self.conn.execute("ALTER TABLE entries ADD COLUMN height INTEGER")
+            # Expression indexes so eviction candidates are read in policy order without a full sort
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (COALESCE(last_played, created))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lfu "
+                              "ON entries (play_count, COALESCE(last_played, created))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+            # Running total of the indexed bytes, kept up to date by add/remove/clear
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        # Only walk the cache directory if it changed behind the index's back (or on first run)
+        if self.is_stale():
+            self.reconcile()
+
+    def get_dir_mtime(self):
+        return str(os.stat(self.cache_dir).st_mtime_ns)
+
+    def is_stale(self):
+        """Return True if the cache directory was modified since the index last recorded a change."""
+        return self.get_meta("dir_mtime") != self.get_dir_mtime()
+
+    def reconcile(self):
+        """Bring the index in line with the files on disk: import unknown files, drop missing ones."""
+        on_disk = {}
+        with os.scandir(self.cache_dir) as it:
+            for dir_entry in it:
+                if dir_entry.is_file() and not dir_entry.name.startswith(self.DB_NAME):
+                    on_disk[dir_entry.name] = dir_entry.stat()
+
+        with self.lock:
+            indexed = {row["path"]: (row["key"], row["size"])
+                       for row in self.conn.execute("SELECT key, path, size FROM entries")}
+
+        added = removed = 0
+        for path, (key, size) in indexed.items():
+            if path not in on_disk:
+                self.remove(key)
+                removed += 1
+            elif on_disk[path].st_size != size:
+                self.add(key, path, size=on_disk[path].st_size)
+        for path, stat in on_disk.items():
+            if path not in indexed:
+                # Files the index doesn't know about are keyed by their file name stem
+                self.add(os.path.splitext(path)[0], path, size=stat.st_size, created=stat.st_mtime)
+                added += 1
+
+        self.mark_synced()
+        logging.info(f"Reconciled cache index with {self.cache_dir}: {added} added, {removed} removed, "
+                     f"{self.count()} entries, {self.total_bytes / (1024 * 1024):.2f} MB.")
+
+    def mark_synced(self):
+        """Record the current directory mtime as matching the index."""
+        self.set_meta("dir_mtime", self.get_dir_mtime())
+
+    def lookup(self, key):
+        """Return the index entry for a key as a dict, or None if the key is not cached."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+    def add(self, key, path, url=None, size=0, fmt=None, created=None, height=None):
+        """Insert or update an entry. Play statistics of an existing entry are preserved."""
+        created = created if created is not None else time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("""
+                INSERT INTO entries (key, path, url, size, format, created, height)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    path = excluded.path,
+                    url = COALESCE(excluded.url, entries.url),
+                    size = excluded.size,
+                    format = COALESCE(excluded.format, entries.format),
+                    height = COALESCE(excluded.height, entries.height)""",
+                              (key, path, url, size, fmt, created, height))
+            self.total_bytes += size - (row["size"] if row else 0)
+            self.set_dir_mtime_locked()
+
+    def touch(self, key):
+        """Record that an entry was played."""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE entries SET last_played = ?, play_count = play_count + 1 WHERE key = ?",
+                              (time.time(), key))
+
+    def eviction_candidates(self, policy="lru", exclude=(), limit=50):
+        """Return up to limit entries in eviction order for the policy ("lru" or "lfu"), skipping excluded keys."""
+        if policy == "lfu":
+            order_by = "play_count, COALESCE(last_played, created)"
+        else:
+            order_by = "COALESCE(last_played, created)"
+        exclude = list(exclude)
+        placeholders = ", ".join("?" for _ in exclude)
+        where = f"WHERE key NOT IN ({placeholders})" if exclude else ""
+
+        with self.lock:
+            rows = self.conn.execute(f"SELECT * FROM entries {where} ORDER BY {order_by} LIMIT ?",
+                                     (*exclude, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def entries_with_url(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM entries WHERE url IS NOT NULL").fetchall()
+        return [dict(row) for row in rows]
+
+    def rekey(self, old_key, new_key, new_path):
+        """Rename an entry (after its file was renamed), keeping its size and play statistics."""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE entries SET key = ?, path = ? WHERE key = ?", (new_key, new_path, old_key))
+            self.set_dir_mtime_locked()
+
+    def remove(self, key):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_bytes -= row["size"]
+            self.set_dir_mtime_locked()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def total_size(self):
+        """Return the total size in bytes of all indexed files."""
+        return self.total_bytes
+
+    def get_meta(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def set_dir_mtime_locked(self):
+        """Record the directory mtime inside the caller's transaction; entries change right after file changes."""
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dir_mtime', ?)",
+                          (self.get_dir_mtime(),))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = VideoPlayer(root)